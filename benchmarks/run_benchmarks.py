@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Benchmark every pipeline stage on synthetic data.
+
+For each size (number of genes) a synthetic data set is generated (see
+synthetic_data.py) and these stages are timed, each in a fresh process so
+that peak RSS is per stage:
+
+    create_cds_ref            reference GTF -> CDS-only GTF       (lines/s)
+    rename_assembly           annotated assembly -> mRNA GTF      (lines/s)
+    write_final_gtf           create_final_v4.write_final_gtf      (transcripts/s)
+    filter_and_correct_strand GTFFilterAndCorrector.run, pysam     (lines/s)
+    annotate_peaks_cold       annotate_peaks, index built from GTF (peaks/s)
+    annotate_peaks_cached     annotate_peaks, cached index         (peaks/s)
+
+A stage that fails or produces no output records aborts the run, so an empty
+output is never reported as a timing.
+
+Usage:
+    python3 benchmarks/run_benchmarks.py --sizes 1000,5000,25000 --output bench.json
+    python3 benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python3 benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+With --baseline, any stage slower than baseline * (1 + tolerance) (and by
+at least --min-seconds) is reported and the exit status is 1. Baselines are
+machine specific: save one per machine/environment you compare on.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_data  # noqa: E402
+
+
+def _count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def stage_create_cds_ref(files, workdir):
+    from create_cds_ref import create_cds_ref
+    output = os.path.join(workdir, 'ChineseLong_v3_CDS_only.gtf')
+    start = time.perf_counter()
+    create_cds_ref(files['ref_gtf'], output)
+    return time.perf_counter() - start, _count_lines(files['ref_gtf']), 'lines', _count_lines(output)
+
+
+def stage_rename_assembly(files, workdir):
+    from rename_assembly import rename_assembly
+    start = time.perf_counter()
+    rename_assembly(files['annotated_gtf'], files['renamed_gtf'])
+    return (time.perf_counter() - start, _count_lines(files['annotated_gtf']), 'lines',
+            _count_lines(files['renamed_gtf']))
+
+
+def stage_write_final_gtf(files, workdir):
+    from create_final_v4 import parse_asm_gtf, parse_ref_gtf, write_final_gtf
+    ref_data = parse_ref_gtf(files['ref_gtf'])
+    asm_data = parse_asm_gtf(files['renamed_gtf'])
+    start = time.perf_counter()
+    write_final_gtf(ref_data, asm_data, files['final_gtf'])
+    return time.perf_counter() - start, len(asm_data), 'transcripts', _count_lines(files['final_gtf'])
+
+
+def stage_filter_and_correct_strand(files, workdir):
+    if 'bam_fwd' not in files:
+        return None
+    from filter_and_correct_strand import GTFFilterAndCorrector
+    output = os.path.join(workdir, 'ChineseLong_v3.final.strand_corrected.gtf')
+    corrector = GTFFilterAndCorrector(files['final_gtf'], files['bam_fwd'], files['bam_rev'], output,
+                                      count_engine='native', threads=1, cache_dir=False)
+    start = time.perf_counter()
+    corrector.run()
+    return time.perf_counter() - start, _count_lines(files['final_gtf']), 'lines', _count_lines(output)
+
+
+def _annotate(files):
+    from annotate_peaks_cucumber import annotate_peaks, csv2bed
+    start = time.perf_counter()
+    peaks_fwd = csv2bed(files['peaks_fwd'], '+')
+    peaks_rev = csv2bed(files['peaks_rev'], '-')
+    results_fwd = annotate_peaks(peaks_fwd, files['final_gtf'])
+    results_rev = annotate_peaks(peaks_rev, files['final_gtf'])
+    return (time.perf_counter() - start, len(peaks_fwd) + len(peaks_rev), 'peaks',
+            len(results_fwd) + len(results_rev))
+
+
+def stage_annotate_peaks_cold(files, workdir):
+    from annotation_index import INDEX_SUFFIX
+    if os.path.exists(files['final_gtf'] + INDEX_SUFFIX):
+        os.remove(files['final_gtf'] + INDEX_SUFFIX)
+    return _annotate(files)
+
+
+def stage_annotate_peaks_cached(files, workdir):
+    return _annotate(files)
+
+
+STAGES = [
+    ('create_cds_ref', stage_create_cds_ref),
+    ('rename_assembly', stage_rename_assembly),
+    ('write_final_gtf', stage_write_final_gtf),
+    ('filter_and_correct_strand', stage_filter_and_correct_strand),
+    ('annotate_peaks_cold', stage_annotate_peaks_cold),
+    ('annotate_peaks_cached', stage_annotate_peaks_cached),
+]
+
+
+def _peak_rss_mb():
+    # ru_maxrss survives exec on Linux (it would include the parent's RSS at
+    # spawn time), so prefer the per-address-space high-water mark
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _stage_worker(stage_name, files, workdir, conn):
+    func = dict(STAGES)[stage_name]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(files, workdir)
+    except Exception as e:
+        conn.send((None, None, f'{type(e).__name__}: {e}'))
+    else:
+        conn.send((result, _peak_rss_mb(), None))
+    conn.close()
+
+
+def run_stage(stage_name, files, workdir):
+    """
+    Run one stage in a fresh (spawned) process; returns a result dict or None
+    if skipped. Raises RuntimeError if the stage fails or writes no records,
+    so a degenerate run is never timed.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_worker, args=(stage_name, files, workdir, child))
+    proc.start()
+    child.close()
+    result, peak_rss_mb, error = parent.recv()
+    proc.join()
+    if error:
+        raise RuntimeError(f"stage {stage_name} failed: {error}")
+    if result is None:
+        return None
+    seconds, records, unit, records_out = result
+    if not records_out:
+        raise RuntimeError(f"stage {stage_name} produced no output records")
+    return {'seconds': round(seconds, 4), 'records': records, 'unit': unit, 'records_out': records_out,
+            'throughput': round(records / seconds, 1) if seconds > 0 else None,
+            'peak_rss_mb': round(peak_rss_mb, 1)}
+
+
+def run_size(n_genes, workdir, seed):
+    files = synthetic_data.generate(workdir, n_genes, seed=seed)
+    files['renamed_gtf'] = os.path.join(workdir, 'final_annotation_v2.gtf')
+    files['final_gtf'] = os.path.join(workdir, 'ChineseLong_v3.final.gtf')
+
+    results = {}
+    for stage_name, _ in STAGES:
+        result = run_stage(stage_name, files, workdir)
+        if result is None:
+            print(f"  {stage_name:<27} skipped (pysam not installed)")
+            continue
+        results[stage_name] = result
+        print(f"  {stage_name:<27} {result['seconds']:>9.3f} s  {result['throughput']:>12,.0f} "
+              f"{result['unit']}/s  {result['peak_rss_mb']:>8.1f} MB")
+    return results
+
+
+def compare(report, baseline, tolerance, min_seconds=0.05):
+    """
+    Return a list of regression messages against a baseline report. A stage
+    regresses when it is slower than baseline * (1 + tolerance) and at least
+    min_seconds slower in absolute terms (filters timer noise on tiny runs).
+    """
+    regressions = []
+    for size, stages in report['results'].items():
+        for stage_name, result in stages.items():
+            base = baseline.get('results', {}).get(size, {}).get(stage_name)
+            if base is None:
+                continue
+            limit = base['seconds'] * (1 + tolerance)
+            if result['seconds'] > limit and result['seconds'] - base['seconds'] >= min_seconds:
+                regressions.append(f"{stage_name} @ {size} genes: {result['seconds']:.3f} s "
+                                   f"(baseline {base['seconds']:.3f} s, +{tolerance:.0%} allowed)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GTF/peak pipeline on synthetic data')
+    parser.add_argument('--sizes', default='1000,5000,25000',
+                        help='comma-separated gene counts (default: 1000,5000,25000)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='keep generated data here (default: temporary directory)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--save-baseline', help='write the JSON report as a new baseline')
+    parser.add_argument('--baseline', help='compare against this baseline report')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown relative to the baseline (default: 0.25)')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='ignore slowdowns smaller than this many seconds (default: 0.05)')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'seed': args.seed, 'results': {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_genes in sizes:
+            workdir = os.path.join(args.workdir or tmp, f'genes_{n_genes}')
+            print(f"{n_genes} genes:")
+            try:
+                report['results'][str(n_genes)] = run_size(n_genes, workdir, args.seed)
+            except RuntimeError as e:
+                sys.exit(str(e))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Report saved to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print("Regressions:")
+            for msg in regressions:
+                print(f"  {msg}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
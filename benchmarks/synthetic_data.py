@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Synthetic cucumber-scale inputs for the benchmarks.
+
+Generates, for a given number of genes:
+- a reference GTF in the ChineseLong_v3 layout (gene/mRNA/exon/CDS/UTR records)
+- an assembled GTF in the StringTie merge layout (transcript/exon records with
+  MSTRG gene ids, longer UTRs, some unmatched and novel isoforms)
+- the same assembly as annotated by gffcompare (cmp_ref/class_code attributes)
+- exomePeak2-style peaks.csv files for the forward and reverse strand
+- small strand-split paired-end BAMs (only when pysam is installed)
+
+Everything is seeded, so the same size always gives the same files.
+"""
+import os
+import random
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+CHROMS = [f'Chr{i}' for i in range(1, 8)] + ['scaffold0001']
+# Chromosome length scales with the gene count (~25k genes on ~300 Mb for cucumber)
+BP_PER_GENE = 12000
+
+PEAK_HEADER = ('"","seqnames","start","end","width","strand","name","score","blockCount",'
+               '"blockSizes","blockStarts","RPM.IP","log2FoldChange","pvalue","fdr"\n')
+
+
+def _genes(n_genes, rng):
+    chrom_len = max(1000000, n_genes * BP_PER_GENE // len(CHROMS))
+    genes = []
+    for g in range(n_genes):
+        c = CHROMS[g % len(CHROMS)]
+        start = rng.randint(1000, chrom_len - 60000)
+        strand = rng.choice('+-')
+        exons = []
+        pos = start
+        for _ in range(rng.randint(1, 12)):
+            length = rng.randint(60, 600)
+            exons.append((pos, pos + length))
+            pos += length + rng.randint(80, 3000)
+        cds_start = exons[0][0] + rng.randint(20, 50)
+        cds_end = exons[-1][1] - rng.randint(20, 50)
+        gene_id = f'CsaV3_{CHROMS.index(c) + 1}G{g * 10:06d}'
+        genes.append((c, strand, gene_id, exons, cds_start, cds_end))
+    return genes, chrom_len
+
+
+def _write_transcript(f, source, c, strand, gene_id, tid, exons, cds_start=None, cds_end=None):
+    attr = f'transcript_id "{tid}"; gene_id "{gene_id}";'
+    f.write(f'{c}\t{source}\tmRNA\t{exons[0][0]}\t{exons[-1][1]}\t.\t{strand}\t.\t{attr}\n')
+    for a, b in exons:
+        f.write(f'{c}\t{source}\texon\t{a}\t{b}\t.\t{strand}\t.\t{attr}\n')
+    if cds_start is None:
+        return
+    left, right = ('five_prime_utr', 'three_prime_utr') if strand == '+' else ('three_prime_utr', 'five_prime_utr')
+    for a, b in exons:
+        if a < cds_start:
+            f.write(f'{c}\t{source}\t{left}\t{a}\t{min(b, cds_start - 1)}\t.\t{strand}\t.\t{attr}\n')
+        if max(a, cds_start) <= min(b, cds_end):
+            f.write(f'{c}\t{source}\tCDS\t{max(a, cds_start)}\t{min(b, cds_end)}\t.\t{strand}\t0\t{attr}\n')
+        if b > cds_end:
+            f.write(f'{c}\t{source}\t{right}\t{max(a, cds_end + 1)}\t{b}\t.\t{strand}\t.\t{attr}\n')
+
+
+def write_reference_gtf(path, genes):
+    with open(path, 'w') as f:
+        for c, strand, gene_id, exons, cds_start, cds_end in genes:
+            f.write(f'{c}\tcsv3\tgene\t{exons[0][0]}\t{exons[-1][1]}\t.\t{strand}\t.\tgene_id "{gene_id}";\n')
+            _write_transcript(f, 'csv3', c, strand, gene_id, f'{gene_id}.1', exons, cds_start, cds_end)
+
+
+def _assembled_transcripts(genes, rng):
+    """
+    StringTie merge transcripts as (c, strand, locus, tid, ref_gene_id, cmp_ref, class_code, exons).
+    Transcripts matching a reference keep its transcript_id, like StringTie does.
+    """
+    transcripts = []
+    for g, (c, strand, gene_id, exons, _, _) in enumerate(genes):
+        # StringTie typically extends both UTRs
+        extended = list(exons)
+        extended[0] = (extended[0][0] - rng.randint(0, 400), extended[0][1])
+        extended[-1] = (extended[-1][0], extended[-1][1] + rng.randint(0, 400))
+        locus = f'MSTRG.{g + 1}'
+        r = rng.random()
+        if r < 0.06:
+            transcripts.append((c, strand, locus, f'{locus}.1', None, None, 'u', extended))
+        else:
+            transcripts.append((c, strand, locus, f'{gene_id}.1', gene_id, f'{gene_id}.1', '=', extended))
+        if r > 0.85 and len(exons) > 2:
+            # novel isoform skipping one internal exon
+            skipped = extended[:1] + extended[2:]
+            transcripts.append((c, strand, locus, f'{locus}.2', None, f'{gene_id}.1', 'j', skipped))
+    return transcripts
+
+
+def write_assembled_gtf(path, transcripts):
+    with open(path, 'w') as f:
+        f.write('# stringtie --merge -G ChineseLong_v3_CDS_only.gtf -o stringtie_merged.gtf merge_list.txt\n'
+                '# StringTie version 2.2.1\n')
+        for c, strand, locus, tid, ref_gene_id, _, _, exons in transcripts:
+            attr = f'gene_id "{locus}"; transcript_id "{tid}";'
+            ref = f' ref_gene_id "{ref_gene_id}";' if ref_gene_id else ''
+            f.write(f'{c}\tStringTie\ttranscript\t{exons[0][0]}\t{exons[-1][1]}\t1000\t{strand}\t.\t{attr}{ref}\n')
+            for n, (a, b) in enumerate(exons, 1):
+                f.write(f'{c}\tStringTie\texon\t{a}\t{b}\t1000\t{strand}\t.\t{attr} exon_number "{n}";{ref}\n')
+
+
+def write_annotated_gtf(path, genes, transcripts):
+    """gffcompare -r <reference> output: <prefix>.annotated.gtf"""
+    gene_of = {f'{gene_id}.1': gene_id for _, _, gene_id, _, _, _ in genes}
+    with open(path, 'w') as f:
+        for k, (c, strand, locus, tid, _, cmp_ref, class_code, exons) in enumerate(transcripts):
+            attr = f'transcript_id "{tid}"; gene_id "{locus}";'
+            extra = f' xloc "XLOC_{k + 1:06d}";'
+            if cmp_ref:
+                extra = (f' gene_name "{gene_of[cmp_ref]}";{extra} ref_gene_id "{gene_of[cmp_ref]}";'
+                         f' cmp_ref "{cmp_ref}";')
+            extra += f' class_code "{class_code}"; tss_id "TSS{k + 1}";'
+            f.write(f'{c}\tStringTie\ttranscript\t{exons[0][0]}\t{exons[-1][1]}\t.\t{strand}\t.\t{attr}{extra}\n')
+            for n, (a, b) in enumerate(exons, 1):
+                f.write(f'{c}\tStringTie\texon\t{a}\t{b}\t.\t{strand}\t.\t{attr} exon_number "{n}";\n')
+
+
+def write_peaks_csv(path, genes, n_peaks, chrom_len, rng):
+    with open(path, 'w') as f:
+        f.write(PEAK_HEADER)
+        for k in range(n_peaks):
+            if rng.random() < 0.75:
+                c, _, _, exons, _, _ = rng.choice(genes)
+                a, b = rng.choice(exons)
+                pos = rng.randint(a - 200, b + 200)
+            else:
+                c = rng.choice(CHROMS)
+                pos = rng.randint(1, chrom_len)
+            width = rng.randint(50, 400)
+            f.write(f'"{k + 1}","{c}",{pos},{pos + width},{width},"*","peak_{k + 1}",0,1,"{width}","0",'
+                    f'{rng.uniform(0, 20):.3f},{rng.uniform(-1, 6):.4f},{rng.random():.4g},{rng.random():.4g}\n')
+
+
+def write_strand_bams(prefix, genes, chrom_len, rng, reads_per_gene=20, read_len=75):
+    """Paired-end BAMs where ~5% of genes show the opposite strand"""
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': c, 'LN': chrom_len + 100000} for c in CHROMS]}
+    paths = []
+    for name, wanted in (('fwd', '+'), ('rev', '-')):
+        reads = []
+        for g, (c, strand, gene_id, exons, _, _) in enumerate(genes):
+            if g % 20 == 0:
+                strand = '-' if strand == '+' else '+'
+            n = reads_per_gene if strand == wanted else rng.randint(0, 2)
+            for k in range(n):
+                a, b = rng.choice(exons)
+                if b - a <= read_len:
+                    continue
+                p = rng.randint(a - 1, b - read_len)
+                q = min(p + rng.randint(0, 150), b - read_len)
+                for mate, (pos, other) in enumerate(((p, q), (q, p))):
+                    r = pysam.AlignedSegment()
+                    r.query_name = f'{gene_id}:{k}'
+                    r.query_sequence = 'A' * read_len
+                    r.flag = 1 | 2 | (64 | 32 if mate == 0 else 128 | 16)
+                    r.reference_id = CHROMS.index(c)
+                    r.reference_start = pos
+                    r.cigarstring = f'{read_len}M'
+                    r.next_reference_id = CHROMS.index(c)
+                    r.next_reference_start = other
+                    r.mapping_quality = 60
+                    r.set_tag('NH', 1)
+                    reads.append(r)
+        reads.sort(key=lambda r: (r.reference_id, r.reference_start))
+        path = f'{prefix}_{name}.bam'
+        with pysam.AlignmentFile(path, 'wb', header=header) as out:
+            for r in reads:
+                out.write(r)
+        pysam.index(path)
+        paths.append(path)
+    return paths
+
+
+def generate(workdir, n_genes, peaks_per_strand=None, seed=1):
+    """Write a full synthetic data set to workdir and return the file paths"""
+    os.makedirs(workdir, exist_ok=True)
+    rng = random.Random(seed)
+    genes, chrom_len = _genes(n_genes, rng)
+    if peaks_per_strand is None:
+        peaks_per_strand = n_genes
+
+    files = {
+        'ref_gtf': os.path.join(workdir, 'ChineseLong_v3.gtf'),
+        'asm_gtf': os.path.join(workdir, 'stringtie_merged.gtf'),
+        'annotated_gtf': os.path.join(workdir, 'gffcompare_out.annotated.gtf'),
+        'peaks_fwd': os.path.join(workdir, 'peaks_fwd.csv'),
+        'peaks_rev': os.path.join(workdir, 'peaks_rev.csv'),
+    }
+    write_reference_gtf(files['ref_gtf'], genes)
+    transcripts = _assembled_transcripts(genes, rng)
+    write_assembled_gtf(files['asm_gtf'], transcripts)
+    write_annotated_gtf(files['annotated_gtf'], genes, transcripts)
+    write_peaks_csv(files['peaks_fwd'], genes, peaks_per_strand, chrom_len, rng)
+    write_peaks_csv(files['peaks_rev'], genes, peaks_per_strand, chrom_len, rng)
+    if pysam is not None:
+        files['bam_fwd'], files['bam_rev'] = write_strand_bams(os.path.join(workdir, 'input'), genes, chrom_len, rng)
+    return files
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Batch peak annotation: annotate many exomePeak2 samples against one loaded
+strand-corrected reference.
+
+Samples come from a tab-separated sample sheet with the columns
+`sample`, `peak_fwd` and `peak_rev` (a header line is required), and/or from
+repeated `--sample NAME FWD_CSV REV_CSV` arguments. Each sample gets its own
+`<outdir>/<sample>.annotated_peaks.tsv` in the usual format, and all samples
+are collected in a long-format table with a leading `sample` column.
+"""
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from annotate_peaks_cucumber import GTF, HEADER, annotate_peaks, csv2bed, result_lines, write_results
+from annotation_index import load_annotation_index
+from peak_output import FORMATS, check_format
+
+COMBINED = "combined_annotated_peaks.tsv"
+
+_worker_index = None
+
+
+def read_sample_sheet(path):
+    samples = []
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            samples.append((row['sample'], row['peak_fwd'], row['peak_rev']))
+    return samples
+
+
+def annotate_sample(index, gtf_file, peak_fwd, peak_rev, max_fdr=None, min_log2fc=None):
+    """Annotate one sample's fwd/rev peaks with the already loaded index"""
+    results_fwd = annotate_peaks(csv2bed(peak_fwd, '+', max_fdr, min_log2fc), gtf_file, index=index)
+    results_rev = annotate_peaks(csv2bed(peak_rev, '-', max_fdr, min_log2fc), gtf_file, index=index)
+    return {**results_fwd, **results_rev}
+
+
+def _init_worker(gtf_file):
+    global _worker_index
+    _worker_index = load_annotation_index(gtf_file)
+
+
+def _annotate_sample_worker(args):
+    gtf_file, output, peak_fwd, peak_rev, formats, max_fdr, min_log2fc = args
+    all_results = annotate_sample(_worker_index, gtf_file, peak_fwd, peak_rev, max_fdr, min_log2fc)
+    write_results(all_results, output, formats)
+    return all_results
+
+
+def annotate_batch(samples, outdir, gtf_file=GTF, jobs=1, combined=COMBINED, formats=('tsv',), max_fdr=None,
+                   min_log2fc=None):
+    """
+    Annotate all samples, loading the reference index once per process.
+    Per-sample files are written in every format in `formats` (see
+    peak_output); the combined table is always TSV. max_fdr and min_log2fc
+    filter the peaks while they are read (see peak_input).
+    Returns {sample: number of annotated peaks}.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    # Build (or validate) the cached index once before any sample is annotated
+    index = load_annotation_index(gtf_file)
+
+    tasks = [(gtf_file, os.path.join(outdir, f'{name}.annotated_peaks.tsv'), peak_fwd, peak_rev, formats,
+              max_fdr, min_log2fc) for name, peak_fwd, peak_rev in samples]
+    counts = {}
+    with open(os.path.join(outdir, combined), 'w') as out:
+        out.write('sample\t' + HEADER)
+
+        if jobs > 1 and len(samples) > 1:
+            pool = ProcessPoolExecutor(max_workers=min(jobs, len(samples)), initializer=_init_worker,
+                                       initargs=(gtf_file,))
+            sample_results = pool.map(_annotate_sample_worker, tasks)
+        else:
+            pool = None
+            sample_results = (annotate_sample(index, gtf_file, peak_fwd, peak_rev, max_fdr, min_log2fc)
+                              for _, _, peak_fwd, peak_rev, _, _, _ in tasks)
+
+        try:
+            for (name, _, _), task, all_results in zip(samples, tasks, sample_results):
+                if pool is None:
+                    write_results(all_results, task[1], formats)
+                for line in result_lines(all_results):
+                    out.write(f'{name}\t{line}')
+                counts[name] = len(all_results)
+                print(f"  {name}: {len(all_results)} peaks -> {task[1]}")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Annotate many exomePeak2 samples against one reference')
+    parser.add_argument('--sample-sheet', help='TSV with columns sample, peak_fwd, peak_rev')
+    parser.add_argument('--sample', nargs=3, action='append', default=[], metavar=('NAME', 'FWD_CSV', 'REV_CSV'),
+                        help='add one sample (may be repeated)')
+    parser.add_argument('-o', '--outdir', default='annotated_peaks', help='output directory (default: annotated_peaks)')
+    parser.add_argument('--gtf', default=GTF, help='strand-corrected GTF (both strands)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='samples annotated in parallel (default: 1)')
+    parser.add_argument('--format', action='append', choices=list(FORMATS), dest='formats',
+                        help='per-sample output format, repeatable: tsv (default), parquet, arrow, bgzip')
+    parser.add_argument('--max-fdr', type=float, metavar='FDR', help='only annotate peaks with fdr <= FDR')
+    parser.add_argument('--min-log2fc', type=float, metavar='LOG2FC',
+                        help='only annotate peaks with log2FoldChange >= LOG2FC')
+    args = parser.parse_args()
+    formats = args.formats or ['tsv']
+    for fmt in formats:
+        try:
+            check_format(fmt)
+        except RuntimeError as e:
+            parser.error(str(e))
+
+    samples = read_sample_sheet(args.sample_sheet) if args.sample_sheet else []
+    samples += [tuple(s) for s in args.sample]
+    if not samples:
+        parser.error('no samples given (use --sample-sheet and/or --sample)')
+    names = [name for name, _, _ in samples]
+    if len(set(names)) != len(names):
+        parser.error('sample names must be unique')
+
+    print(f"Annotating {len(samples)} samples...")
+    annotate_batch(samples, args.outdir, args.gtf, jobs=args.jobs, formats=formats, max_fdr=args.max_fdr,
+                   min_log2fc=args.min_log2fc)
+    print(f"Combined table saved to {os.path.join(args.outdir, COMBINED)}")
+
+
+if __name__ == '__main__':
+    main()
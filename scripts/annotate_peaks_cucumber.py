@@ -1,263 +1,402 @@
 #!/usr/bin/env python3
 
+import argparse
+import heapq
+import itertools
 import os
-import subprocess
 import tempfile
-import re
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
 
-GTF_FWD = "/data/czh/reference_genome/cucumber/ChineseLong_v3.final.strand_corrected.fwd.gtf"
-GTF_REV = "/data/czh/reference_genome/cucumber/ChineseLong_v3.final.strand_corrected.rev.gtf"
+from annotate_vectorized import annotate_chromosome_numpy, annotate_peaks_numpy, np
+from annotation_index import FEATURE_NAMES, FEATURE_PRIORITY, load_annotation_index
+from intervals import sweep_sorted, sweep_stream
+from peak_input import iter_peaks, read_peaks
+from peak_output import COLUMNS, FORMATS, ISOFORM_COLUMNS, NEAREST_COLUMNS, check_format, format_row, output_path, write_rows
+from run_report import RunReport
+
+# Written by filter_and_correct_strand.py; indexed per (chromosome, strand),
+# so fwd and rev peaks are annotated against the same file
+GTF = "/data/czh/reference_genome/cucumber/ChineseLong_v3.final.strand_corrected.gtf"
 
 PEAK_FWD = "exomePeak2_fwd/exomePeak2_fwd_whole_genome/peaks.csv"
 PEAK_REV = "exomePeak2_rev/exomePeak2_rev_whole_genome/peaks.csv"
 OUTPUT = "exomePeak2_annotated_peaks_cucumber_strand_corrected.tsv"
+ISOFORM_OUTPUT = "exomePeak2_annotated_peaks_cucumber_strand_corrected.isoforms.tsv"
 
-def csv2bed(csv_file, strand):
-    peaks = []
-    with open(csv_file, 'r') as f:
-        next(f)
-        for line in f:
-            parts = line.strip().split(',')
-            if len(parts) < 15:
-                continue
-            chr = parts[1].replace('"', '')
-            start = parts[2].replace('"', '')
-            end = parts[3].replace('"', '')
-            log2fc = parts[12].replace('"', '')
-            pval = parts[13].replace('"', '')
-            fdr = parts[14].replace('"', '')
-            peaks.append((chr, start, end, strand, log2fc, pval, fdr))
-    return peaks
-
-def extract_gtf_features(gtf_file):
-    gene_regions = {}
-    cds_start = {}
-    cds_end = {}
-    
-    with open(gtf_file, 'r') as f:
-        for line in f:
-            if line.startswith('#'):
-                continue
-            parts = line.strip().split('\t')
-            if len(parts) < 9:
-                continue
-            
-            chr, source, feature, start, end, score, strand, frame, attr = parts
-            start, end = int(start), int(end)
-            
-            gene_id = None
-            m = re.search(r'gene_id "([^"]+)"', attr)
-            if m:
-                gene_id = m.group(1)
-            
-            if gene_id is None:
-                continue
-            
-            key = (chr, strand, gene_id)
-            
-            if feature == 'mRNA':
-                if key not in gene_regions:
-                    gene_regions[key] = (start, end)
-            elif feature == 'CDS':
-                if strand == '+':
-                    if key not in cds_start or start < cds_start[key]:
-                        cds_start[key] = start
-                    if key not in cds_end or end > cds_end[key]:
-                        cds_end[key] = end
-                else:
-                    if key not in cds_start or start < cds_start[key]:
-                        cds_start[key] = start
-                    if key not in cds_end or end > cds_end[key]:
-                        cds_end[key] = end
+def csv2bed(csv_file, strand, max_fdr=None, min_log2fc=None):
+    return read_peaks(csv_file, strand, max_fdr, min_log2fc)
+
+def classify_hits(index, genes, ranks, hits):
+    """Annotation of one peak from the index rows it overlaps"""
+    if not hits:
+        return {'gene': 'intergenic', 'feature': 'intergenic', 'priority': FEATURE_PRIORITY['intergenic']}
     
-    return gene_regions, cds_start, cds_end
+    # The highest-priority feature claims the peak, with all of its genes
+    best = min(ranks[k] for k in hits)
+    seen = set()
+    gene_ids = []
+    for k in hits:
+        gene_id = index.genes[genes[k]]
+        if ranks[k] != best or not gene_id or gene_id == '.' or gene_id in seen:
+            continue
+        seen.add(gene_id)
+        gene_ids.append(gene_id)
+    if not gene_ids:
+        return None
+    return {'gene': ','.join(gene_ids), 'feature': FEATURE_NAMES[best], 'priority': best}
 
-def write_bed_file(items, filename):
-    with open(filename, 'w') as f:
-        for item in items:
-            if len(item) == 7:
-                f.write(f"{item[0]}\t{item[1]}\t{item[2]}\t{item[3]}\t{item[4]}\t{item[5]}\t{item[6]}\n")
-            else:
-                f.write(f"{item[0]}\t{item[1]}\t{item[2]}\t{item[3]}\t{item[4]}\n")
+def classify_isoforms(iso_index, transcripts, ranks, hits):
+    """[(gene_id, transcript_id, feature)] of one peak, the best feature per isoform, sorted by ids"""
+    best = {}
+    for k in hits:
+        t = transcripts[k]
+        if t not in best or ranks[k] < best[t]:
+            best[t] = ranks[k]
+    names, parents = iso_index.genes, iso_index.parents
+    return sorted((parents[t], names[t], FEATURE_NAMES[rank]) for t, rank in best.items())
 
-def run_bedtools(cmd):
-    subprocess.run(cmd, shell=True, check=True)
+def annotate_chromosome(index, peaks):
+    """Annotate peaks (all on one chromosome strand) against index, one result per peak"""
+    annotations = [None] * len(peaks)
+    if not peaks:
+        return annotations
+    starts, ends, orders, genes, ranks = index.partition(peaks[0][0], peaks[0][3])
+    for qi, hits in sweep_sorted(peaks, range(len(peaks)), starts, ends, orders):
+        annotations[qi] = classify_hits(index, genes, ranks, hits)
+    return annotations
 
-def annotate_peaks(peaks, gtf_file, out_strand):
-    gene_regions, cds_start, cds_end = extract_gtf_features(gtf_file)
-    
-    priority = {'three_prime_utr': 1, 'stop_codon': 2, 'exon': 3, 'start_codon': 4, 'five_prime_utr': 5, 'intron': 6, 'intergenic': 7}
-    results = {}
-    
-    tmp_dir = tempfile.mkdtemp()
-    peak_file = os.path.join(tmp_dir, 'peaks.bed')
-    with open(peak_file, 'w') as f:
-        for p in peaks:
-            f.write(f"{p[0]}\t{p[1]}\t{p[2]}\t{p[3]}\t{p[4]}\t{p[5]}\t{p[6]}\n")
-    
-    remaining = peak_file
-    
-    features_to_check = [
-        ('three_prime_utr', 'three_prime_utr'),
-        ('stop_codon', 'stop_codon'),
-        ('exon', 'exon'),
-        ('start_codon', 'start_codon'),
-        ('five_prime_utr', 'five_prime_utr')
-    ]
-    
-    for feat_name, gtf_feature in features_to_check:
-        feat_file = os.path.join(tmp_dir, f'{feat_name}.bed')
-        
-        feat_items = []
-        with open(gtf_file, 'r') as f:
-            for line in f:
-                if line.startswith('#'):
-                    continue
-                parts = line.strip().split('\t')
-                if len(parts) < 9:
-                    continue
-                chr, source, feature, start, end, score, strand, frame, attr = parts
-                if feature != gtf_feature:
-                    continue
-                start, end = int(start), int(end)
-                gene_id_match = re.search(r'gene_id "([^"]+)"', attr)
-                if gene_id_match:
-                    gene_id = gene_id_match.group(1)
-                    # Use name field (5th column) for gene_id
-                    feat_items.append((chr, start, end, strand, '.', '.', gene_id))
-        
-        if feat_name in ['stop_codon', 'start_codon']:
-            processed_items = []
-            for key in (cds_start if feat_name == 'start_codon' else cds_end):
-                chr, strand, gene_id = key
-                if feat_name == 'stop_codon':
-                    if strand == '+' and key in cds_end:
-                        pos = cds_end[key]
-                        processed_items.append((chr, pos - 10, pos + 10, strand, '.', '.', gene_id))
-                    elif strand == '-' and key in cds_start:
-                        pos = cds_start[key]
-                        processed_items.append((chr, pos - 10, pos + 10, strand, '.', '.', gene_id))
-                else:
-                    if strand == '+' and key in cds_start:
-                        pos = cds_start[key]
-                        processed_items.append((chr, pos - 10, pos + 10, strand, '.', '.', gene_id))
-                    elif strand == '-' and key in cds_end:
-                        pos = cds_end[key]
-                        processed_items.append((chr, pos - 10, pos + 10, strand, '.', '.', gene_id))
-            feat_items = processed_items
-        
-        if not feat_items:
-            continue
-        
-        write_bed_file(feat_items, feat_file)
-        
-        overlap_file = os.path.join(tmp_dir, f'overlap_{feat_name}.bed')
-        run_bedtools(f"bedtools intersect -a {remaining} -b {feat_file} -wa -wb > {overlap_file}")
-        
-        with open(overlap_file, 'r') as f:
-            for line in f:
-                parts = line.strip().split('\t')
-                # Peak has 7 cols, bed file has 7 cols, so gene_id is at column 14 (index 13)
-                if len(parts) < 14:
-                    continue
-                chr, start, end = parts[0], int(parts[1]), int(parts[2])
-                strand = parts[3]
-                log2fc, pval, fdr = parts[4], parts[5], parts[6]
-                
-                # gene_id is in column 14 for bed files with 7 columns
-                gene_id = parts[13]
-                
-                if not gene_id or gene_id == '' or gene_id == '.':
-                    continue
-                
-                key = (chr, start, end, strand, log2fc, pval, fdr)
-                if key not in results:
-                    results[key] = {'gene': gene_id, 'feature': feat_name, 'priority': priority[feat_name]}
-                else:
-                    if gene_id not in results[key]['gene']:
-                        results[key]['gene'] += ',' + gene_id
-                    if priority[feat_name] < results[key]['priority']:
-                        results[key]['feature'] = feat_name
-                        results[key]['priority'] = priority[feat_name]
-        
-        new_remaining = os.path.join(tmp_dir, f'remaining_{feat_name}.bed')
-        run_bedtools(f"bedtools intersect -a {remaining} -b {feat_file} -v > {new_remaining}")
-        os.remove(remaining)
-        remaining = new_remaining
-    
-    gene_file = os.path.join(tmp_dir, 'gene.bed')
-    gene_items = [(chr, start, end, strand, '.', '.', gene_id) for (chr, strand, gene_id), (start, end) in gene_regions.items()]
-    write_bed_file(gene_items, gene_file)
-    
-    intron_overlap = os.path.join(tmp_dir, 'intron_overlap.bed')
-    run_bedtools(f"bedtools intersect -a {remaining} -b {gene_file} -wa -wb > {intron_overlap}")
-    
-    with open(intron_overlap, 'r') as f:
-        for line in f:
-            parts = line.strip().split('\t')
-            # Peak has 7 cols, gene bed has 7 cols, so gene_id is at column 14 (index 13)
-            if len(parts) < 14:
-                continue
-            chr, start, end = parts[0], int(parts[1]), int(parts[2])
-            strand = parts[3]
-            log2fc, pval, fdr = parts[4], parts[5], parts[6]
-            gene_id = parts[13]
-            
-            key = (chr, start, end, strand, log2fc, pval, fdr)
-            if key not in results:
-                results[key] = {'gene': gene_id, 'feature': 'intron', 'priority': priority['intron']}
-            else:
-                if gene_id not in results[key]['gene']:
-                    results[key]['gene'] += ',' + gene_id
+def with_nearest_gene(index, peak, annotation):
+    """Intergenic annotations get 'nearest': (gene_id, signed distance, direction) or None"""
+    if annotation is None or annotation['priority'] != FEATURE_PRIORITY['intergenic']:
+        return annotation
+    return dict(annotation, nearest=index.nearest_gene(peak[0], peak[1], peak[2], peak[3]))
+
+# Per-chromosome classifiers; 'numpy' is opt-in (see annotate_vectorized)
+BACKENDS = {'python': annotate_chromosome, 'numpy': annotate_chromosome_numpy}
+DEFAULT_BACKEND = 'python'
+
+_worker_index = None
+
+def _init_worker(gtf_file):
+    global _worker_index
+    _worker_index = load_annotation_index(gtf_file)
+
+def _annotate_shard(args):
+    backend, peaks = args
+    return BACKENDS[backend](_worker_index, peaks)
+
+def annotate_isoforms(iso_index, peaks, qis):
+    """{peak index: classify_isoforms() list} for the peaks qis of one chromosome strand"""
+    starts, ends, orders, transcripts, ranks = iso_index.partition(peaks[qis[0]][0], peaks[qis[0]][3])
+    return {qi: classify_isoforms(iso_index, transcripts, ranks, hits)
+            for qi, hits in sweep_sorted(peaks, qis, starts, ends, orders)}
+
+def normalize_peaks(peaks):
+    """Peaks as a list of 7-tuples with integer start/end; already normalized input is returned as is"""
+    peaks = peaks if isinstance(peaks, list) else list(peaks)
+    if (set(map(len, peaks)) <= {7} and set(map(type, map(itemgetter(1), peaks))) <= {int}
+            and set(map(type, map(itemgetter(2), peaks))) <= {int}):
+        return peaks
+    return [(p[0], int(p[1]), int(p[2]), p[3], p[4], p[5], p[6]) for p in peaks]
+
+def partition_shards(peaks):
+    """Peak indices per (chromosome, strand), largest groups first so a pool stays busy"""
+    by_chr = {}
+    for qi, p in enumerate(peaks):
+        by_chr.setdefault((p[0], p[3]), []).append(qi)
+    return sorted(by_chr.values(), key=len, reverse=True)
+
+def annotate_peaks(peaks, gtf_file, jobs=1, index=None, backend=DEFAULT_BACKEND, nearest=False, isoforms=False):
+    # Build (or validate) the on-disk index before any worker maps it
+    if index is None:
+        index = load_annotation_index(gtf_file)
     
-    intergenic_file = os.path.join(tmp_dir, 'intergenic.bed')
-    run_bedtools(f"bedtools intersect -a {remaining} -b {gene_file} -v > {intergenic_file}")
+    peaks = normalize_peaks(peaks)
+    shards = None
+    if backend == 'numpy' and jobs <= 1:
+        # whole strand at once; coordinates stay in arrays until the result dicts
+        annotations = annotate_peaks_numpy(index, peaks)
+    else:
+        shards = partition_shards(peaks)
+        shard_peaks = [[peaks[qi] for qi in qis] for qis in shards]
+        if jobs > 1 and len(shards) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(shards)), initializer=_init_worker,
+                                     initargs=(gtf_file,)) as pool:
+                shard_results = list(pool.map(_annotate_shard, [(backend, chr_peaks) for chr_peaks in shard_peaks]))
+        else:
+            shard_results = [BACKENDS[backend](index, chr_peaks) for chr_peaks in shard_peaks]
+        annotations = [None] * len(peaks)
+        for qis, shard_annotations in zip(shards, shard_results):
+            for qi, annotation in zip(qis, shard_annotations):
+                annotations[qi] = annotation
     
-    with open(intergenic_file, 'r') as f:
-        for line in f:
-            parts = line.strip().split('\t')
-            if len(parts) < 7:
-                continue
-            chr, start, end = parts[0], int(parts[1]), int(parts[2])
-            strand = parts[3]
-            log2fc, pval, fdr = parts[4], parts[5], parts[6]
-            
-            key = (chr, start, end, strand, log2fc, pval, fdr)
-            results[key] = {'gene': 'intergenic', 'feature': 'intergenic', 'priority': priority['intergenic']}
+    if not nearest and not isoforms:
+        # identical peaks get identical annotations, so keeping the last one of
+        # a duplicated key is the same as keeping the first
+        keep = [annotation is not None for annotation in annotations]
+        return dict(zip(itertools.compress(peaks, keep), itertools.compress(annotations, keep)))
     
-    import shutil
-    shutil.rmtree(tmp_dir)
+    isoform_hits = {}
+    if isoforms:
+        iso_index = load_annotation_index(gtf_file, isoforms=True)
+        for qis in shards or partition_shards(peaks):
+            isoform_hits.update(annotate_isoforms(iso_index, peaks, qis))
     
+    results = {}
+    for qi, (peak, annotation) in enumerate(zip(peaks, annotations)):
+        if annotation is not None and peak not in results:
+            if nearest:
+                annotation = with_nearest_gene(index, peak, annotation)
+            if isoforms:
+                annotation = dict(annotation, isoforms=isoform_hits[qi])
+            results[peak] = annotation
     return results
 
-print("Processing forward strand...")
-peaks_fwd = csv2bed(PEAK_FWD, '+')
-results_fwd = annotate_peaks(peaks_fwd, GTF_FWD, '+')
-print(f"  Found {len(results_fwd)} peaks")
+HEADER = '\t'.join(COLUMNS) + '\n'
 
-print("Processing reverse strand...")
-peaks_rev = csv2bed(PEAK_REV, '-')
-results_rev = annotate_peaks(peaks_rev, GTF_REV, '-')
-print(f"  Found {len(results_rev)} peaks")
+def nearest_fields(annotation):
+    """NEAREST_COLUMNS values of one annotation ('NA' unless intergenic with a gene on the chromosome)"""
+    nearest = annotation.get('nearest')
+    return nearest if nearest else ('NA', 'NA', 'NA')
 
-all_results = {**results_fwd, **results_rev}
-
-with open(OUTPUT, 'w') as f:
-    f.write("chr\tpeak_start\tpeak_end\tstrand\tgeneid\tfeature\tlog2FC\tpvalue\tfdr\n")
-    
-    sorted_keys = sorted(all_results.keys(), key=lambda x: (x[0], x[1], x[2], x[3]))
+def unique_results(all_results):
+    """(peak, annotation) sorted by position, exact duplicates dropped"""
+    sorted_keys = sorted(all_results, key=itemgetter(0, 1, 2, 3))
     prev_key = None
+    prev_str = None
     for key in sorted_keys:
-        chr, start, end, strand, log2fc, pval, fdr = key
-        current_key_str = f"{chr}\t{start}\t{end}\t{strand}\t{log2fc}\t{pval}\t{fdr}"
-        
-        if prev_key is not None:
-            prev_str = f"{prev_key[0]}\t{prev_key[1]}\t{prev_key[2]}\t{prev_key[3]}\t{prev_key[4]}\t{prev_key[5]}\t{prev_key[6]}"
+        # keys are distinct and coordinates are ints, so only peaks at the same
+        # position can print the same line
+        if prev_key is not None and key[:4] == prev_key[:4]:
+            current_key_str = '\t'.join(map(str, key))
+            if prev_str is None:
+                prev_str = '\t'.join(map(str, prev_key))
             if current_key_str == prev_str:
                 continue
+            prev_str = current_key_str
+        else:
+            prev_str = None
         
         prev_key = key
-        r = all_results[key]
-        f.write(f"{chr}\t{start}\t{end}\t{strand}\t{r['gene']}\t{r['feature']}\t{log2fc}\t{pval}\t{fdr}\n")
+        yield key, all_results[key]
+
+def result_rows(all_results, nearest=False):
+    """Output rows sorted by position, exact duplicates dropped"""
+    for (chr, start, end, strand, log2fc, pval, fdr), r in unique_results(all_results):
+        row = (chr, start, end, strand, r['gene'], r['feature'], log2fc, pval, fdr)
+        yield row + nearest_fields(r) if nearest else row
+
+def isoform_rows(all_results):
+    """
+    Long format: one row per (peak, gene, isoform) with the isoform's own
+    best feature; a peak without isoform hits gets one intergenic row
+    """
+    for (chr, start, end, strand, log2fc, pval, fdr), r in unique_results(all_results):
+        for gene_id, transcript_id, feature in r['isoforms'] or [('intergenic', 'NA', 'intergenic')]:
+            yield (chr, start, end, strand, gene_id, transcript_id, feature, log2fc, pval, fdr)
+
+def result_lines(all_results, nearest=False):
+    """Output lines (without header) sorted by position, exact duplicates dropped"""
+    return map(format_row, result_rows(all_results, nearest))
+
+def output_columns(nearest=False):
+    return COLUMNS + NEAREST_COLUMNS if nearest else COLUMNS
+
+def write_results(all_results, output, formats=('tsv',), nearest=False):
+    return write_rows(result_rows(all_results, nearest), output, formats, output_columns(nearest))
+
+def write_isoforms(all_results, output, formats=('tsv',)):
+    return write_rows(isoform_rows(all_results), output, formats, ISOFORM_COLUMNS)
+
+def sort_key(peak):
+    return (peak[0], peak[1], peak[2], peak[3])
+
+def _read_chunk(path):
+    with open(path, 'r') as f:
+        for line in f:
+            chr, start, end, strand, log2fc, pval, fdr = line.rstrip('\n').split('\t')
+            yield (chr, int(start), int(end), strand, log2fc, pval, fdr)
+
+def sorted_peaks(peaks, tmp_dir, chunk_size):
+    """
+    External merge sort of peaks by (chr, start, end, strand): sorted runs of
+    chunk_size peaks are spilled to tmp_dir and merged lazily. The merge is
+    stable, so equal keys keep their input order.
+    """
+    chunk_files = []
+    chunk = []
+    for p in peaks:
+        chunk.append((p[0], int(p[1]), int(p[2]), p[3], p[4], p[5], p[6]))
+        if len(chunk) >= chunk_size:
+            chunk.sort(key=sort_key)
+            fd, path = tempfile.mkstemp(suffix='.peaks', dir=tmp_dir)
+            with os.fdopen(fd, 'w') as f:
+                f.writelines('\t'.join(map(str, p)) + '\n' for p in chunk)
+            chunk_files.append(path)
+            chunk = []
+    chunk.sort(key=sort_key)
+    return heapq.merge(*[_read_chunk(path) for path in chunk_files], iter(chunk), key=sort_key)
+
+def annotate_stream(peaks, index, nearest=False):
+    """Yield (peak, annotation) for peaks of one strand sorted by chromosome and start"""
+    for (chr, strand), group in itertools.groupby(peaks, key=itemgetter(0, 3)):
+        starts, ends, orders, genes, ranks = index.partition(chr, strand)
+        for peak, hits in sweep_stream(group, starts, ends, orders):
+            annotation = classify_hits(index, genes, ranks, hits)
+            if annotation is not None:
+                yield peak, with_nearest_gene(index, peak, annotation) if nearest else annotation
+
+def stream_rows(records, nearest=False):
+    """
+    Output rows for sorted (peak, annotation) records. Like result_rows, a
+    peak that occurs several times with identical values is written once.
+    """
+    group_key = None
+    seen = set()
+    for peak, r in records:
+        if sort_key(peak) != group_key:
+            group_key = sort_key(peak)
+            seen.clear()
+        if peak in seen:
+            continue
+        seen.add(peak)
+        chr, start, end, strand, log2fc, pval, fdr = peak
+        row = (chr, start, end, strand, r['gene'], r['feature'], log2fc, pval, fdr)
+        yield row + nearest_fields(r) if nearest else row
+
+def write_stream(records, output, formats=('tsv',), nearest=False):
+    return write_rows(stream_rows(records, nearest), output, formats, output_columns(nearest))
+
+def annotate_streaming(strands, output, chunk_size, formats=('tsv',), nearest=False, max_fdr=None,
+                       min_log2fc=None):
+    """
+    Bounded-memory annotation: each strand's peaks are read lazily, sorted in
+    spilled chunks, swept against the memory-mapped index and merged into
+    the output as they are produced.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        streams = []
+        indexes = {}
+        for peak_csv, gtf_file, strand in strands:
+            index = indexes.get(gtf_file) or indexes.setdefault(gtf_file, load_annotation_index(gtf_file))
+            peaks = sorted_peaks(iter_peaks(peak_csv, strand, max_fdr, min_log2fc), tmp_dir, chunk_size)
+            streams.append(annotate_stream(peaks, index, nearest))
+        return write_stream(heapq.merge(*streams, key=lambda r: sort_key(r[0])), output, formats, nearest)
+
+def annotate_strand(peak_csv, gtf_file, strand, jobs=1, profile_dir=None, backend=DEFAULT_BACKEND, nearest=False,
+                    isoforms=False, max_fdr=None, min_log2fc=None):
+    """Annotate one strand; returns (results, stage records) so it can run in a worker process"""
+    report = RunReport('annotate_peaks_' + ('fwd' if strand == '+' else 'rev'), profile_dir)
+    with report.stage('load_peaks') as st:
+        peaks = csv2bed(peak_csv, strand, max_fdr, min_log2fc)
+        st['records_out'] = len(peaks)
+    with report.stage('load_index') as st:
+        index = load_annotation_index(gtf_file)
+        st['records_out'] = len(index)
+    with report.stage('annotate', records_in=len(peaks)) as st:
+        results = annotate_peaks(peaks, gtf_file, jobs=jobs, index=index, backend=backend, nearest=nearest,
+                                 isoforms=isoforms)
+        st['records_out'] = len(results)
+    return results, report.stages
+
+def main():
+    parser = argparse.ArgumentParser(description='Annotate exomePeak2 peaks with cucumber gene features')
+    parser.add_argument('-j', '--jobs', type=int, default=2,
+                        help='worker processes; with 2 or more the forward and reverse strands run '
+                             'concurrently and the rest annotate chromosomes in parallel (default: 2)')
+    parser.add_argument('--stream', action='store_true',
+                        help='bounded-memory mode for very large peak sets: sort peaks in spilled '
+                             'chunks and write results incrementally (single process)')
+    parser.add_argument('--chunk-size', type=int, default=1000000,
+                        help='peaks held in memory per sorted chunk in --stream mode (default: 1000000)')
+    parser.add_argument('--report', metavar='FILE',
+                        help='write per-stage wall/CPU time, peak RSS and record counts as JSON')
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help='also profile every stage with cProfile and write the .prof files here')
+    parser.add_argument('--format', action='append', choices=list(FORMATS), dest='formats',
+                        help='output format, repeatable: tsv (default), parquet, arrow (typed columns, '
+                             'need pyarrow), bgzip (BGZF + tabix index, needs pysam)')
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help='overlap classification: python (per-peak sweep, default) or numpy '
+                             '(vectorized, needs NumPy); the output is identical')
+    parser.add_argument('--nearest-gene', action='store_true',
+                        help='add nearest_gene, distance and direction columns: the nearest same-strand '
+                             'gene of each intergenic peak, with the signed distance (negative upstream '
+                             'of the TSS, positive past the 3\' end)')
+    parser.add_argument('--isoforms', action='store_true',
+                        help=f'also write a long-format table with one row per (peak, gene, isoform) and the '
+                             f'feature of the peak in that isoform ({ISOFORM_OUTPUT})')
+    parser.add_argument('--max-fdr', type=float, metavar='FDR',
+                        help='only annotate peaks with fdr <= FDR (peaks with fdr NA are dropped)')
+    parser.add_argument('--min-log2fc', type=float, metavar='LOG2FC',
+                        help='only annotate peaks with log2FoldChange >= LOG2FC (NA is dropped)')
+    args = parser.parse_args()
+    if args.isoforms and args.stream:
+        parser.error('--isoforms is not supported with --stream')
+    if args.backend == 'numpy' and np is None:
+        parser.error('--backend numpy needs NumPy: pip install numpy')
+    formats = args.formats or ['tsv']
+    for fmt in formats:
+        try:
+            check_format(fmt)
+        except RuntimeError as e:
+            parser.error(str(e))
+    
+    strands = [('forward', PEAK_FWD, GTF, '+'), ('reverse', PEAK_REV, GTF, '-')]
+    report = RunReport('annotate_peaks', args.profile_dir)
+    
+    if args.stream:
+        print("Streaming forward and reverse strands...")
+        with report.stage('annotate_stream') as st:
+            count = annotate_streaming([(peak_csv, gtf_file, strand) for _, peak_csv, gtf_file, strand in strands],
+                                       OUTPUT, args.chunk_size, formats, args.nearest_gene, args.max_fdr,
+                                       args.min_log2fc)
+            st['records_out'] = count
+        print(f"  Wrote {count} peaks")
+    else:
+        if args.jobs >= 2:
+            print("Processing forward and reverse strands concurrently...")
+            strand_jobs = args.jobs // 2
+            # Both strands share one GTF: build (or validate) its indexes once before the workers map them
+            load_annotation_index(GTF)
+            if args.isoforms:
+                load_annotation_index(GTF, isoforms=True)
+            with ProcessPoolExecutor(max_workers=2) as pool:
+                futures = [pool.submit(annotate_strand, peak_csv, gtf_file, strand, strand_jobs, args.profile_dir,
+                                       args.backend, args.nearest_gene, args.isoforms, args.max_fdr,
+                                       args.min_log2fc)
+                           for _, peak_csv, gtf_file, strand in strands]
+                outcomes = [future.result() for future in futures]
+            for (name, _, _, _), (strand_results, _) in zip(strands, outcomes):
+                print(f"  {name}: found {len(strand_results)} peaks")
+        else:
+            outcomes = []
+            for name, peak_csv, gtf_file, strand in strands:
+                print(f"Processing {name} strand...")
+                outcomes.append(annotate_strand(peak_csv, gtf_file, strand, profile_dir=args.profile_dir,
+                                                backend=args.backend, nearest=args.nearest_gene,
+                                                isoforms=args.isoforms, max_fdr=args.max_fdr,
+                                                min_log2fc=args.min_log2fc))
+                print(f"  Found {len(outcomes[-1][0])} peaks")
+        
+        for (name, _, _, _), (_, stages) in zip(strands, outcomes):
+            report.extend(stages, prefix=f'{name}.')
+        (results_fwd, _), (results_rev, _) = outcomes
+        all_results = {**results_fwd, **results_rev}
+        with report.stage('write', records_in=len(all_results)) as st:
+            st['records_out'] = write_results(all_results, OUTPUT, formats, args.nearest_gene)
+        if args.isoforms:
+            with report.stage('write_isoforms', records_in=len(all_results)) as st:
+                st['records_out'] = write_isoforms(all_results, ISOFORM_OUTPUT, formats)
+    
+    for fmt in formats:
+        print(f"Output saved to {output_path(OUTPUT, fmt)}")
+        if args.isoforms:
+            print(f"Isoform table saved to {output_path(ISOFORM_OUTPUT, fmt)}")
+    if args.report:
+        report.save(args.report)
+        print(f"Run report saved to {args.report}")
 
-print(f"Output saved to {OUTPUT}")
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 #!/usr/bin/env bash
 
-GTF_FWD="/data/czh/reference_genome/cucumber/ChineseLong_v3.final.strand_corrected.fwd.gtf"
-GTF_REV="/data/czh/reference_genome/cucumber/ChineseLong_v3.final.strand_corrected.rev.gtf"
+GTF="/data/czh/reference_genome/cucumber/ChineseLong_v3.final.strand_corrected.gtf"
 
 PEAK_FWD="exomePeak2_fwd/exomePeak2_fwd_whole_genome/peaks.csv"
 PEAK_REV="exomePeak2_rev/exomePeak2_rev_whole_genome/peaks.csv"
@@ -26,6 +25,7 @@ annotate_single_strand() {
     local gtf_file=$2
     local out_strand=$3
     
+    local tmp_gtf=$(mktemp)
     local tmp_exon=$(mktemp)
     local tmp_3utr=$(mktemp)
     local tmp_5utr=$(mktemp)
@@ -34,11 +34,14 @@ annotate_single_strand() {
     local tmp_gene=$(mktemp)
     local tmp_remain=$(mktemp)
     
-    awk -F'\t' '$3 == "exon"' "$gtf_file" > "$tmp_exon"
-    awk -F'\t' '$3 == "three_prime_utr"' "$gtf_file" > "$tmp_3utr"
-    awk -F'\t' '$3 == "five_prime_utr"' "$gtf_file" > "$tmp_5utr"
+    # bedtools intersect below ignores strand, so keep only this strand's features
+    awk -F'\t' -v s="$out_strand" '$7 == s' "$gtf_file" > "$tmp_gtf"
     
-    awk -F'\t' '$3 == "CDS"' "$gtf_file" | sort -k1,1 -k4,4n -k5,5n | awk -F'\t' '{
+    awk -F'\t' '$3 == "exon"' "$tmp_gtf" > "$tmp_exon"
+    awk -F'\t' '$3 == "three_prime_utr"' "$tmp_gtf" > "$tmp_3utr"
+    awk -F'\t' '$3 == "five_prime_utr"' "$tmp_gtf" > "$tmp_5utr"
+    
+    awk -F'\t' '$3 == "CDS"' "$tmp_gtf" | sort -k1,1 -k4,4n -k5,5n | awk -F'\t' '{
         gene=""; if ($0 ~ /gene_id "([^"]+)"/) {match($0, /gene_id "([^"]+)"/, m); gene=m[1]}
         key=$1"\t"$7"\t"gene
         if ($7 == "+") { if (!(key in cds_end) || $5 > cds_end[key]) cds_end[key] = $5 }
@@ -48,7 +51,7 @@ annotate_single_strand() {
         for (k in cds_start) { split(k,arr,"\t"); if (arr[2]=="-") print arr[1]"\t"(cds_start[k]-10)"\t"(cds_start[k]+10)"\t"arr[2]"\t"arr[3] }
     }' | sort -k1,1 -k2,2n > "$tmp_stop"
     
-    awk -F'\t' '$3 == "CDS"' "$gtf_file" | sort -k1,1 -k4,4n -k5,5n | awk -F'\t' '{
+    awk -F'\t' '$3 == "CDS"' "$tmp_gtf" | sort -k1,1 -k4,4n -k5,5n | awk -F'\t' '{
         gene=""; if ($0 ~ /gene_id "([^"]+)"/) {match($0, /gene_id "([^"]+)"/, m); gene=m[1]}
         key=$1"\t"$7"\t"gene
         if ($7 == "+") { if (!(key in cds_start) || $4 < cds_start[key]) cds_start[key] = $4 }
@@ -58,7 +61,7 @@ annotate_single_strand() {
         for (k in cds_end) { split(k,arr,"\t"); if (arr[2]=="-") print arr[1]"\t"(cds_end[k]-10)"\t"(cds_end[k]+10)"\t"arr[2]"\t"arr[3] }
     }' | sort -k1,1 -k2,2n > "$tmp_start"
     
-    awk -F'\t' '$3 == "mRNA"' "$gtf_file" | awk -F'\t' '{
+    awk -F'\t' '$3 == "mRNA"' "$tmp_gtf" | awk -F'\t' '{
         gene=""; if ($0 ~ /gene_id "([^"]+)"/) {match($0, /gene_id "([^"]+)"/, m); gene=m[1]}
         print $1"\t"$4"\t"$5"\t"$7"\t"gene
     }' | sort -k1,1 -k2,2n > "$tmp_gene"
@@ -134,7 +137,7 @@ annotate_single_strand() {
     
     cat "$tmp_new"
     
-    rm "$tmp_exon" "$tmp_3utr" "$tmp_5utr" "$tmp_stop" "$tmp_start" "$tmp_gene" "$tmp_remain" "$tmp_intron_overlap" "$tmp_new"
+    rm "$tmp_gtf" "$tmp_exon" "$tmp_3utr" "$tmp_5utr" "$tmp_stop" "$tmp_start" "$tmp_gene" "$tmp_remain" "$tmp_intron_overlap" "$tmp_new"
 }
 
 echo -e "chr\tpeak_start\tpeak_end\tstrand\tgeneid\tfeature\tlog2FC\tpvalue\tfdr" > "$OUTPUT"
@@ -142,11 +145,17 @@ echo -e "chr\tpeak_start\tpeak_end\tstrand\tgeneid\tfeature\tlog2FC\tpvalue\tfdr
 tmp_fwd=$(mktemp)
 tmp_rev=$(mktemp)
 
-csv2bed "$PEAK_FWD" "+" > "$tmp_fwd"
-csv2bed "$PEAK_REV" "-" > "$tmp_rev"
+csv2bed "$PEAK_FWD" "+" > "$tmp_fwd" &
+csv2bed "$PEAK_REV" "-" > "$tmp_rev" &
+wait
 
-annotate_single_strand "$tmp_fwd" "$GTF_FWD" "+" > "${tmp_fwd}.annotated"
-annotate_single_strand "$tmp_rev" "$GTF_REV" "-" > "${tmp_rev}.annotated"
+# The two strands share nothing until the merge below, so run them concurrently
+annotate_single_strand "$tmp_fwd" "$GTF" "+" > "${tmp_fwd}.annotated" &
+pid_fwd=$!
+annotate_single_strand "$tmp_rev" "$GTF" "-" > "${tmp_rev}.annotated" &
+pid_rev=$!
+wait "$pid_fwd" || exit 1
+wait "$pid_rev" || exit 1
 
 cat "${tmp_fwd}.annotated" "${tmp_rev}.annotated" \
 | sort -k1,1 -k2,2n -k3,3n -k4,4 \
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+NumPy backend for annotate_peaks(): classifies all peaks of a chromosome at once.
+
+The index partition (intervals sorted by start) is viewed as NumPy arrays
+without copying. For every peak, the candidate intervals are the range
+[lo, hi) where hi = searchsorted(starts, peak_end) and lo is found with
+searchsorted on the running maximum of the interval ends, so no interval
+left of lo can reach the peak. All (peak, interval) candidate pairs are
+expanded in one go, filtered to real overlaps, and sorted by
+(peak, feature rank, input order); the best rank per peak is the first pair
+of its group. Gene ids stay integer codes until the result dicts are built,
+and only peaks whose best feature has several genes go through Python to
+join the gene names. Results are identical to annotate_chromosome().
+
+annotate_peaks_numpy() does the same for a whole strand: peaks are grouped
+by (chromosome, strand) with a stable argsort and their coordinates stay in
+arrays through classification; one shared result dict is built per distinct
+(feature, gene) and fanned out to the peaks with a single index lookup.
+
+This is opt-in (`--backend numpy`). On 200k peaks per strand the annotate
+stage is about 2.6x faster than the sweep, not 10x: the classification is
+about 0.14 s per strand, and most of the rest is building the peak-keyed
+result dicts that annotate_peaks() returns.
+"""
+import itertools
+from operator import itemgetter
+
+from annotation_index import FEATURE_NAMES, FEATURE_PRIORITY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INTERGENIC = FEATURE_PRIORITY['intergenic']
+
+
+def _valid_genes(index):
+    """Boolean array: gene code -> usable gene id (not empty or '.'), cached on the index"""
+    valid = getattr(index, '_valid_genes', None)
+    if valid is None:
+        valid = np.fromiter((bool(g) and g != '.' for g in index.genes), bool, len(index.genes))
+        index._valid_genes = valid
+    return valid
+
+
+def overlap_pairs(starts, ends, qs, qe):
+    """
+    All (query, interval) pairs with starts[k] < qe[q] and ends[k] > qs[q],
+    for intervals sorted by start. Returns (query indices, interval indices),
+    grouped by query in ascending order.
+    """
+    lo = np.searchsorted(np.maximum.accumulate(ends), qs, side='right')
+    hi = np.searchsorted(starts, qe, side='left')
+    counts = np.maximum(hi - lo, 0)
+    total = int(counts.sum())
+    pair_q = np.repeat(np.arange(len(qs)), counts)
+    first = np.cumsum(counts) - counts
+    pair_k = np.repeat(lo - first, counts) + np.arange(total)
+    overlap = ends[pair_k] > qs[pair_q]
+    return pair_q[overlap], pair_k[overlap]
+
+
+def classify_chromosome(index, qs, qe, starts, ends, orders, genes, ranks):
+    """
+    Vectorized classification of peaks [qs, qe) against one partition.
+    Returns (best rank per peak, first valid gene code per peak or -1,
+    {peak: joined gene string} for peaks whose best feature has several genes).
+    """
+    n = len(qs)
+    best = np.full(n, INTERGENIC, np.int8)
+    gene = np.full(n, -1, np.int64)
+    if n == 0 or len(starts) == 0:
+        return best, gene, {}
+
+    pair_q, pair_k = overlap_pairs(starts, ends, qs, qe)
+    if len(pair_q) == 0:
+        return best, gene, {}
+
+    # sort by (peak, rank, input order) through one packed int64 key
+    pair_r = ranks[pair_k]
+    order = np.argsort((pair_q << 35) | (pair_r.astype(np.int64) << 32) | orders[pair_k].astype(np.int64))
+    pair_q, pair_k, pair_r = pair_q[order], pair_k[order], pair_r[order]
+
+    group_start = np.flatnonzero(np.r_[True, pair_q[1:] != pair_q[:-1]])
+    best[pair_q[group_start]] = pair_r[group_start]
+
+    # genes of the best feature, in input order; invalid ids do not count
+    pair_g = genes[pair_k]
+    keep = (pair_r == best[pair_q]) & _valid_genes(index)[pair_g]
+    pair_q, pair_g = pair_q[keep], pair_g[keep]
+    if len(pair_q) == 0:
+        return best, gene, {}
+    # the same gene hit several times (e.g. exons of its isoforms) counts once;
+    # np.unique keeps the first occurrence, which is restored to input order
+    _, first_seen = np.unique(pair_q * len(index.genes) + pair_g, return_index=True)
+    first_seen.sort()
+    pair_q, pair_g = pair_q[first_seen], pair_g[first_seen]
+    group_start = np.flatnonzero(np.r_[True, pair_q[1:] != pair_q[:-1]])
+    gene[pair_q[group_start]] = pair_g[group_start]
+
+    multi = {}
+    names = index.genes
+    group_end = np.r_[group_start[1:], len(pair_q)]
+    for s, e in zip(group_start[group_end - group_start > 1].tolist(),
+                    group_end[group_end - group_start > 1].tolist()):
+        multi[int(pair_q[s])] = ','.join([names[code] for code in pair_g[s:e].tolist()])
+    return best, gene, multi
+
+
+def annotation_dicts(index, best, gene, multi):
+    """
+    One {'gene', 'feature', 'priority'} dict or None per peak from
+    classify_chromosome() output. Peaks with the same annotation share one
+    (read-only) dict, so gene ids are materialized once per distinct result.
+    """
+    names = index.genes
+    width = len(names) + 1
+    keys, inverse = np.unique(best.astype(np.int64) * width + (gene + 1), return_inverse=True)
+    distinct = []
+    for rank, code in zip((keys // width).tolist(), (keys % width).tolist()):
+        if rank == INTERGENIC:
+            distinct.append({'gene': 'intergenic', 'feature': FEATURE_NAMES[rank], 'priority': rank})
+        elif code:
+            distinct.append({'gene': names[code - 1], 'feature': FEATURE_NAMES[rank], 'priority': rank})
+        else:
+            distinct.append(None)
+    annotations = list(map(distinct.__getitem__, inverse.ravel().tolist()))
+    shared = {}
+    for qi, gene_id in multi.items():
+        rank = int(best[qi])
+        annotation = shared.get((rank, gene_id))
+        if annotation is None:
+            annotation = shared[rank, gene_id] = {'gene': gene_id, 'feature': FEATURE_NAMES[rank],
+                                                  'priority': rank}
+        annotations[qi] = annotation
+    return annotations
+
+
+def annotate_chromosome_numpy(index, peaks):
+    """Drop-in for annotate_chromosome(): one {'gene', 'feature', 'priority'} or None per peak"""
+    if not peaks:
+        return []
+    n = len(peaks)
+    qs = np.fromiter((p[1] for p in peaks), np.int64, n)
+    qe = np.fromiter((p[2] for p in peaks), np.int64, n)
+    columns = [np.asarray(col) for col in index.partition(peaks[0][0], peaks[0][3])]
+    return annotation_dicts(index, *classify_chromosome(index, qs, qe, *columns))
+
+
+def partition_groups(keys):
+    """
+    [((chromosome, strand), peak indices)] for an iterable of per-peak
+    (chromosome, strand) keys, with the indices as arrays in input order;
+    groups come in order of first occurrence
+    """
+    # setdefault with a counter gives each key the index of its first peak
+    first = {}
+    codes = np.fromiter(map(first.setdefault, keys, itertools.count()), np.int64)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.r_[True, codes[order][1:] != codes[order][:-1]])
+    names = {code: key for key, code in first.items()}
+    return [(names[int(codes[qis[0]])], qis) for qis in np.split(order, bounds[1:])]
+
+
+def annotate_peaks_numpy(index, peaks):
+    """
+    annotate_chromosome_numpy() for peaks of any chromosomes and strands, in
+    one pass: one annotation dict or None per peak, in input order
+    """
+    if not peaks:
+        return []
+    n = len(peaks)
+    qs = np.fromiter(map(itemgetter(1), peaks), np.int64, n)
+    qe = np.fromiter(map(itemgetter(2), peaks), np.int64, n)
+    best = np.full(n, INTERGENIC, np.int8)
+    gene = np.full(n, -1, np.int64)
+    multi = {}
+    for (chr, strand), qis in partition_groups(map(itemgetter(0, 3), peaks)):
+        columns = [np.asarray(col) for col in index.partition(chr, strand)]
+        best[qis], gene[qis], group_multi = classify_chromosome(index, qs[qis], qe[qis], *columns)
+        multi.update(zip(qis[list(group_multi)].tolist(), group_multi.values()))
+    return annotation_dicts(index, best, gene, multi)
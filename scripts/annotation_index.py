@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Persistent peak-annotation index.
+
+All intervals used by annotate_peaks() (UTRs, exons, start/stop codon
+windows around the CDS and mRNA spans) are stored per (chromosome, strand),
+sorted by start, as flat binary arrays in `<gtf>.annidx` next to the GTF, so
+one index of the combined strand-corrected GTF serves the peaks of both
+strands. The file is
+memory-mapped on load. It is keyed by the GTF's size, mtime and SHA-1 and is
+rebuilt automatically whenever the GTF changes.
+
+The isoform index (`<gtf>.isoidx`) has the same layout with one set of
+intervals per transcript instead of per gene; its names are transcript ids
+and `parents` maps each one to its gene.
+"""
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+from gtf_utils import file_sha1, load_gtf
+
+INDEX_VERSION = 2
+INDEX_SUFFIX = '.annidx'
+ISOFORM_SUFFIX = '.isoidx'
+MAGIC = b'CGTFIDX\0'
+
+FEATURE_PRIORITY = {'three_prime_utr': 1, 'stop_codon': 2, 'exon': 3, 'start_codon': 4,
+                    'five_prime_utr': 5, 'intron': 6, 'intergenic': 7}
+FEATURE_NAMES = {v: k for k, v in FEATURE_PRIORITY.items()}
+
+# (name, typecode) of the per-interval columns, in file order
+_COLUMNS = (('start', 'q'), ('end', 'q'), ('order', 'i'), ('gene', 'i'), ('rank', 'b'))
+
+
+def extract_gtf_features(gtf):
+    gene_regions = {}
+    cds_start = {}
+    cds_end = {}
+
+    for i in gtf.rows('mRNA', 'CDS'):
+        gene_id = gtf.gene_id[i]
+        if gene_id is None:
+            continue
+
+        chr, feature, strand = gtf.chrom(i), gtf.feature(i), gtf.strand(i)
+        start, end = gtf.start[i], gtf.end[i]
+        key = (chr, strand, gene_id)
+
+        if feature == 'mRNA':
+            if key not in gene_regions:
+                gene_regions[key] = (start, end)
+        else:
+            if key not in cds_start or start < cds_start[key]:
+                cds_start[key] = start
+            if key not in cds_end or end > cds_end[key]:
+                cds_end[key] = end
+
+    return gene_regions, cds_start, cds_end
+
+
+def feature_intervals(gtf):
+    """All annotation intervals as (chr, strand, start, end, (priority, gene_id))"""
+    gene_regions, cds_start, cds_end = extract_gtf_features(gtf)
+    priority = FEATURE_PRIORITY
+
+    items = []
+    for feat_name in ['three_prime_utr', 'exon', 'five_prime_utr']:
+        for i in gtf.rows(feat_name):
+            gene_id = gtf.gene_id[i]
+            if gene_id:
+                items.append((gtf.chrom(i), gtf.strand(i), gtf.start[i], gtf.end[i],
+                              (priority[feat_name], gene_id)))
+
+    # stop_codon/start_codon: CDS end/start +/-10bp depending on strand
+    for key, pos in cds_end.items():
+        chr, strand, gene_id = key
+        if strand not in ('+', '-'):
+            continue
+        feat_name = 'stop_codon' if strand == '+' else 'start_codon'
+        items.append((chr, strand, pos - 10, pos + 10, (priority[feat_name], gene_id)))
+    for key, pos in cds_start.items():
+        chr, strand, gene_id = key
+        if strand not in ('+', '-'):
+            continue
+        feat_name = 'start_codon' if strand == '+' else 'stop_codon'
+        items.append((chr, strand, pos - 10, pos + 10, (priority[feat_name], gene_id)))
+
+    for (chr, strand, gene_id), (start, end) in gene_regions.items():
+        items.append((chr, strand, start, end, (priority['intron'], gene_id)))
+
+    return items
+
+
+def isoform_intervals(gtf):
+    """
+    Per-transcript annotation intervals as (chr, strand, start, end,
+    (priority, transcript_id)), with the same feature rules as feature_intervals(), and
+    {transcript_id: gene_id}
+    """
+    spans = {}
+    cds_start = {}
+    cds_end = {}
+    parents = {}
+    for i in gtf.rows('mRNA', 'CDS'):
+        tid, gene_id = gtf.transcript_id[i], gtf.gene_id[i]
+        if not tid or not gene_id or gene_id == '.':
+            continue
+        parents.setdefault(tid, gene_id)
+        key = (gtf.chrom(i), gtf.strand(i), tid)
+        start, end = gtf.start[i], gtf.end[i]
+        if gtf.feature(i) == 'mRNA':
+            spans.setdefault(key, (start, end))
+        else:
+            if key not in cds_start or start < cds_start[key]:
+                cds_start[key] = start
+            if key not in cds_end or end > cds_end[key]:
+                cds_end[key] = end
+
+    priority = FEATURE_PRIORITY
+    items = []
+    for feat_name in ['three_prime_utr', 'exon', 'five_prime_utr']:
+        for i in gtf.rows(feat_name):
+            tid, gene_id = gtf.transcript_id[i], gtf.gene_id[i]
+            if tid and gene_id and gene_id != '.':
+                parents.setdefault(tid, gene_id)
+                items.append((gtf.chrom(i), gtf.strand(i), gtf.start[i], gtf.end[i],
+                              (priority[feat_name], tid)))
+    for bounds, (head, tail) in ((cds_end, ('stop_codon', 'start_codon')),
+                                 (cds_start, ('start_codon', 'stop_codon'))):
+        for (chr, strand, tid), pos in bounds.items():
+            if strand not in ('+', '-'):
+                continue
+            feat_name = head if strand == '+' else tail
+            items.append((chr, strand, pos - 10, pos + 10, (priority[feat_name], tid)))
+    for (chr, strand, tid), (start, end) in spans.items():
+        items.append((chr, strand, start, end, (priority['intron'], tid)))
+    return items, parents
+
+
+class AnnotationIndex:
+    def __init__(self, genes, partitions, columns, key=None, mm=None, parents=None):
+        self.genes = genes
+        self.parents = parents
+        # (chr, strand) -> (lo, hi) row range
+        self.partitions = partitions
+        self.columns = columns
+        self.key = key
+        self._mm = mm
+        self._spans = {}
+
+    @classmethod
+    def from_gtf(cls, gtf_file, key=None, isoforms=False):
+        """Gene-level index of gtf_file, or the per-transcript one with isoforms=True"""
+        gtf = load_gtf(gtf_file)
+        if isoforms:
+            items, parent_of = isoform_intervals(gtf)
+        else:
+            items, parent_of = feature_intervals(gtf), None
+        order = sorted(range(len(items)), key=lambda k: (items[k][0], items[k][1], items[k][2], k))
+
+        genes = []
+        gene_codes = {}
+        partitions = {}
+        columns = {name: array(code) for name, code in _COLUMNS}
+        for pos, k in enumerate(order):
+            chr, strand, start, end, (rank, gene_id) = items[k]
+            if (chr, strand) not in partitions:
+                partitions[chr, strand] = [pos, pos]
+            partitions[chr, strand][1] = pos + 1
+            code = gene_codes.get(gene_id)
+            if code is None:
+                code = gene_codes[gene_id] = len(genes)
+                genes.append(gene_id)
+            columns['start'].append(start)
+            columns['end'].append(end)
+            columns['order'].append(k)
+            columns['gene'].append(code)
+            columns['rank'].append(rank)
+        parents = [parent_of[name] for name in genes] if isoforms else None
+        return cls(genes, {p: tuple(v) for p, v in partitions.items()}, columns, key, parents=parents)
+
+    def __len__(self):
+        return len(self.columns['start'])
+
+    def partition(self, chr, strand):
+        """(starts, ends, orders, genes, ranks) of one chromosome strand, sorted by start"""
+        lo, hi = self.partitions.get((chr, strand), (0, 0))
+        return tuple(self.columns[name][lo:hi] for name, _ in _COLUMNS)
+
+    def gene_spans(self, chr, strand):
+        """
+        (starts, ends, genes, reach) of one chromosome strand's gene spans (the
+        mRNA span intervals, as in gene.bed of the shell version), sorted by
+        start; reach[i] is the span with the largest end among the first i + 1
+        """
+        spans = self._spans.get((chr, strand))
+        if spans is None:
+            starts, ends, _, genes, ranks = self.partition(chr, strand)
+            span_rank = FEATURE_PRIORITY['intron']
+            keep = [k for k in range(len(ranks))
+                    if ranks[k] == span_rank and self.genes[genes[k]] not in ('', '.')]
+            reach = []
+            best = -1
+            for i, k in enumerate(keep):
+                if best < 0 or ends[k] > ends[keep[best]]:
+                    best = i
+                reach.append(best)
+            spans = self._spans[chr, strand] = ([starts[k] for k in keep], [ends[k] for k in keep],
+                                        [genes[k] for k in keep], reach)
+        return spans
+
+    def nearest_gene(self, chr, start, end, strand):
+        """
+        Nearest gene span on the same strand of an interval that overlaps
+        none, as (gene_id, signed distance, 'upstream' or 'downstream'). The
+        distance is the gap to the span edge, negative when the interval lies
+        upstream of the gene's TSS and positive past its 3' end. Ties go to
+        the gene on the left. None if the chromosome strand has no genes.
+        """
+        starts, ends, genes, reach = self.gene_spans(chr, strand)
+        # spans starting before the interval ends all lie to its left
+        hi = bisect_left(starts, end)
+        left = reach[hi - 1] if hi > 0 else None
+        right = hi if hi < len(starts) else None
+        if left is None and right is None:
+            return None
+        if right is None or (left is not None and start - ends[left] <= starts[right] - end):
+            k, distance, gene_left = left, start - ends[left], True
+        else:
+            k, distance, gene_left = right, starts[right] - end, False
+        upstream = gene_left == (strand == '-')
+        return (self.genes[genes[k]], -distance if upstream else distance,
+                'upstream' if upstream else 'downstream')
+
+    def save(self, path):
+        header = {'version': INDEX_VERSION, 'key': self.key, 'length': len(self), 'genes': self.genes,
+                  'partitions': [[chr, strand, lo, hi] for (chr, strand), (lo, hi) in self.partitions.items()]}
+        if self.parents is not None:
+            header['parents'] = self.parents
+        header = json.dumps(header).encode()
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for name, _ in _COLUMNS:
+                f.write(b'\0' * (-f.tell() % 8))
+                f.write(memoryview(self.columns[name]).cast('B'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved index; returns None if it is unreadable or outdated"""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = len(MAGIC)
+        (header_len,) = struct.unpack_from('<Q', mm, offset)
+        offset += 8
+        header = json.loads(mm[offset:offset + header_len])
+        if header.get('version') != INDEX_VERSION:
+            mm.close()
+            return None
+        offset += header_len
+
+        n = header['length']
+        view = memoryview(mm)
+        columns = {}
+        for name, code in _COLUMNS:
+            offset += -offset % 8
+            size = array(code).itemsize * n
+            columns[name] = view[offset:offset + size].cast(code)
+            offset += size
+        partitions = {(chr, strand): (lo, hi) for chr, strand, lo, hi in header['partitions']}
+        return cls(header['genes'], partitions, columns, header['key'], mm, header.get('parents'))
+
+
+def load_annotation_index(gtf_file, isoforms=False):
+    """
+    Load the cached index for gtf_file, rebuilding it if the GTF changed;
+    isoforms=True selects the per-transcript index
+    """
+    path = gtf_file + (ISOFORM_SUFFIX if isoforms else INDEX_SUFFIX)
+    st = os.stat(gtf_file)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = AnnotationIndex.load(path)
+        except (OSError, ValueError, KeyError, struct.error):
+            index = None
+
+    if index is not None and index.key:
+        if index.key['size'] == st.st_size and index.key['mtime_ns'] == st.st_mtime_ns:
+            return index
+        # mtime changed (e.g. copied or touched): fall back to the content hash
+        if index.key['size'] == st.st_size and index.key['sha1'] == file_sha1(gtf_file):
+            index.key['mtime_ns'] = st.st_mtime_ns
+            try:
+                index.save(path)
+            except OSError:
+                pass
+            return index
+
+    key = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': file_sha1(gtf_file)}
+    index = AnnotationIndex.from_gtf(gtf_file, key, isoforms)
+    try:
+        index.save(path)
+    except OSError:
+        # read-only reference directory: use the index in memory only
+        pass
+    return index
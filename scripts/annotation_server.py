@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Long-lived peak annotation service.
+
+Loads the annotation index of the strand-corrected GTF once and answers batched
+"annotate these intervals" requests over localhost HTTP or a Unix socket,
+through the same annotate_chromosome()/classify_hits() path as
+annotate_peaks_cucumber.py, so a small request costs microseconds of work per
+interval instead of a full GTF load and follows the CLI's rules exactly.
+
+    python3 annotation_server.py                       # http://127.0.0.1:8765
+    python3 annotation_server.py --socket /tmp/annot.sock
+
+    POST /annotate   JSON: {"intervals": [{"chr": "Chr1", "start": 100, "end": 300, "strand": "+"}, ...]}
+                     (an interval may also be a [chr, start, end, strand] list)
+                     -> {"results": [{"chr": ..., "start": ..., "end": ..., "strand": ...,
+                                      "geneid": ..., "feature": ...}, ...]}
+                     TSV: lines "chr<TAB>start<TAB>end<TAB>strand" -> the same lines with
+                     geneid and feature appended
+    GET  /health     -> {"status": "ok", ...}
+
+Results come back in request order. An interval whose best feature has no
+valid gene (dropped from annotate_peaks() output) gets geneid/feature null
+("NA" in TSV).
+"""
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from annotate_peaks_cucumber import GTF, annotate_chromosome, partition_shards
+from annotation_index import load_annotation_index
+
+
+class AnnotationService:
+    """Annotation index held in memory, queried per request like the CLI's python backend"""
+
+    def __init__(self, gtf_file=GTF):
+        self.gtf_file = gtf_file
+        self.index = load_annotation_index(gtf_file)
+
+    def annotate(self, intervals):
+        """Annotate (chr, start, end, strand) tuples; one result dict per interval, in order"""
+        peaks = []
+        for chr, start, end, strand in intervals:
+            if strand not in ('+', '-'):
+                raise ValueError(f"strand must be '+' or '-', got {strand!r}")
+            peaks.append((chr, int(start), int(end), strand))
+        annotations = [None] * len(peaks)
+        for qis in partition_shards(peaks):
+            for qi, annotation in zip(qis, annotate_chromosome(self.index, [peaks[qi] for qi in qis])):
+                annotations[qi] = annotation
+        return [{'chr': chr, 'start': start, 'end': end, 'strand': strand,
+                 'geneid': annotation['gene'] if annotation else None,
+                 'feature': annotation['feature'] if annotation else None}
+                for (chr, start, end, strand), annotation in zip(peaks, annotations)]
+
+
+def _parse_json_intervals(body):
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data['intervals']
+    intervals = []
+    for item in data:
+        if isinstance(item, dict):
+            intervals.append((item['chr'], item['start'], item['end'], item['strand']))
+        else:
+            chr, start, end, strand = item
+            intervals.append((chr, start, end, strand))
+    return intervals
+
+
+def _parse_tsv_intervals(body):
+    intervals = []
+    for line in body.splitlines():
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) < 4:
+            raise ValueError(f"expected chr, start, end, strand: {line!r}")
+        intervals.append(tuple(fields[:4]))
+    return intervals
+
+
+class AnnotationHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def _send(self, status, body, content_type='application/json'):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/health':
+            self._send(404, json.dumps({'error': 'not found'}))
+            return
+        service = self.service
+        self._send(200, json.dumps({'status': 'ok', 'gtf': service.gtf_file, 'intervals': len(service.index)}))
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/annotate':
+            self._send(404, json.dumps({'error': 'not found'}))
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        as_tsv = 'json' not in self.headers.get('Content-Type', '') and body.lstrip()[:1] not in ('{', '[')
+        try:
+            intervals = _parse_tsv_intervals(body) if as_tsv else _parse_json_intervals(body)
+            results = self.service.annotate(intervals)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, json.dumps({'error': str(e)}))
+            return
+        if as_tsv:
+            lines = [f"{r['chr']}\t{r['start']}\t{r['end']}\t{r['strand']}\t"
+                     f"{r['geneid'] or 'NA'}\t{r['feature'] or 'NA'}\n" for r in results]
+            self._send(200, ''.join(lines), 'text/tab-separated-values')
+        else:
+            self._send(200, json.dumps({'results': results}))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, host='127.0.0.1', port=8765, socket_path=None, verbose=False):
+    handler = type('Handler', (AnnotationHandler,), {'service': service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, handler)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve peak annotation from an in-memory annotation index')
+    parser.add_argument('--gtf', default=GTF, help='strand-corrected GTF (both strands)')
+    parser.add_argument('--host', default='127.0.0.1', help='HTTP bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='HTTP port (default: 8765)')
+    parser.add_argument('--socket', metavar='PATH', help='listen on this Unix socket instead of HTTP')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    print("Loading annotation index...")
+    service = AnnotationService(args.gtf)
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"Serving annotation on {where} (Ctrl-C to stop)")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,68 +4,38 @@
 从ChineseLong_v3.gtf中提取gene和CDS，去除mRNA/exon信息
 避免StringTie过度依赖旧注释
 """
-import re
+from gtf_utils import load_gtf
 
 def create_cds_ref(input_gtf, output_gtf):
+    gtf = load_gtf(input_gtf)
+    gene_code = gtf._features.codes.get('gene')
+    
+    # 只记录行号，输出时直接从列数组取值
     genes = {}
     cds_regions = {}
+    for i in gtf.rows('gene', 'CDS'):
+        if gtf.feature_codes[i] == gene_code:
+            gene_id = gtf.gene_id[i]
+            if gene_id:
+                genes[gene_id] = i
+        else:
+            transcript_id = gtf.transcript_id[i]
+            if transcript_id:
+                cds_regions.setdefault(transcript_id, []).append(i)
     
-    with open(input_gtf, 'r') as f:
-        for line in f:
-            if line.startswith('#'):
-                continue
-            fields = line.strip().split('\t')
-            if len(fields) < 9:
-                continue
-            
-            chrom = fields[0]
-            source = fields[1]
-            feature = fields[2]
-            start = int(fields[3])
-            end = int(fields[4])
-            strand = fields[6]
-            frame = fields[7]
-            attributes = fields[8]
-            
-            gene_id = None
-            transcript_id = None
-            
-            for attr in attributes.split(';'):
-                attr = attr.strip()
-                if attr.startswith('gene_id'):
-                    m = re.search(r'"([^"]+)"', attr)
-                    if m:
-                        gene_id = m.group(1)
-                elif attr.startswith('transcript_id'):
-                    m = re.search(r'"([^"]+)"', attr)
-                    if m:
-                        transcript_id = m.group(1)
-            
-            if feature == 'gene' and gene_id:
-                genes[gene_id] = {'chrom': chrom, 'source': source,
-                                  'start': start, 'end': end, 'strand': strand}
-            elif feature == 'CDS' and transcript_id:
-                if transcript_id not in cds_regions:
-                    cds_regions[transcript_id] = []
-                cds_regions[transcript_id].append({
-                    'chrom': chrom, 'source': source, 'start': start,
-                    'end': end, 'strand': strand, 'frame': frame, 'gene_id': gene_id
-                })
-    
+    chroms, sources, strands, frames = gtf.chroms, gtf._sources.names, gtf.strands, gtf._frames.names
+    chrom_codes, source_codes, strand_codes, frame_codes = (gtf.chrom_codes, gtf.source_codes,
+                                                            gtf.strand_codes, gtf.frame_codes)
+    starts, ends = gtf.start, gtf.end
     with open(output_gtf, 'w') as f:
-        for gene_id, gene_info in genes.items():
-            attr = f'gene_id "{gene_id}";'
-            f.write(f"{gene_info['chrom']}\t{gene_info['source']}\tgene\t"
-                   f"{gene_info['start']}\t{gene_info['end']}\t.\t"
-                   f"{gene_info['strand']}\t.\t{attr}\n")
+        f.writelines(f"{chroms[chrom_codes[i]]}\t{sources[source_codes[i]]}\tgene\t{starts[i]}\t{ends[i]}\t.\t"
+                     f"{strands[strand_codes[i]]}\t.\tgene_id \"{gene_id}\";\n"
+                     for gene_id, i in genes.items())
         
-        for transcript_id, cds_list in cds_regions.items():
-            gene_id = cds_list[0]['gene_id']
-            for cds in cds_list:
-                attr = f'transcript_id "{transcript_id}"; gene_id "{gene_id}";'
-                f.write(f"{cds['chrom']}\t{cds['source']}\tCDS\t"
-                       f"{cds['start']}\t{cds['end']}\t.\t"
-                       f"{cds['strand']}\t{cds['frame']}\t{attr}\n")
+        for transcript_id, rows in cds_regions.items():
+            attr = f'transcript_id "{transcript_id}"; gene_id "{gtf.gene_id[rows[0]]}";'
+            f.writelines(f"{chroms[chrom_codes[i]]}\t{sources[source_codes[i]]}\tCDS\t{starts[i]}\t{ends[i]}\t.\t"
+                         f"{strands[strand_codes[i]]}\t{frames[frame_codes[i]]}\t{attr}\n" for i in rows)
     
     print(f"基因数量: {len(genes)}, 转录本数量: {len(cds_regions)}")
     print(f"输出: {output_gtf}")
@@ -1,180 +1,172 @@
 #!/usr/bin/env python3
 """
 从final_annotation_v2.gtf开始，添加CDS和UTR
-使用exons边界和参考CDS来计算UTR
+参考CDS与组装exons求交集（CDS裁剪到exons内），UTR为CDS两侧的exon片段（不含内含子），
+每个转录本用双指针在已排序区间上线性计算
 """
-import re
-from collections import defaultdict
+from gtf_utils import load_gtf
+from transcript_store import build_transcripts
 
 def parse_ref_gtf(gtf_file):
-    """解析参考GTF，提取转录本的CDS"""
-    transcripts = {}
-    with open(gtf_file, 'r') as f:
-        for line in f:
-            if line.startswith('#'):
-                continue
-            fields = line.strip().split('\t')
-            if len(fields) < 9:
-                continue
-            
-            feature = fields[2]
-            start, end = int(fields[3]), int(fields[4])
-            strand = fields[6]
-            
-            gene_id = None
-            transcript_id = None
-            for attr in fields[8].split(';'):
-                attr = attr.strip()
-                if attr.startswith('gene_id'):
-                    m = re.search(r'"([^"]+)"', attr)
-                    if m:
-                        gene_id = m.group(1)
-                elif attr.startswith('transcript_id'):
-                    m = re.search(r'"([^"]+)"', attr)
-                    if m:
-                        transcript_id = m.group(1)
-            
-            if feature == 'mRNA' and transcript_id:
-                if transcript_id not in transcripts:
-                    transcripts[transcript_id] = {
-                        'gene_id': gene_id,
-                        'strand': strand,
-                        'cds': []
-                    }
-            
-            if feature == 'CDS' and transcript_id in transcripts:
-                transcripts[transcript_id]['cds'].append((start, end))
-    
-    return transcripts
+    """
+    解析参考GTF，提取转录本的CDS（TranscriptStore，子区间为CDS）
+    store.phase5[k]为第k个转录本5'端CDS的frame（相位），作为裁剪后CDS的读框锚点
+    """
+    gtf = load_gtf(gtf_file)
+    ref_data = build_transcripts(gtf, 'mRNA', 'CDS')
+    ref_data.phase5 = cds_start_phases(gtf, ref_data)
+    return ref_data
+
+def cds_start_phases(gtf, ref_data):
+    """每个转录本5'端（+链最左、-链最右）CDS记录的frame，'.'或缺失时为0"""
+    phases = [0] * len(ref_data)
+    row, offsets = ref_data.row, ref_data.offsets
+    block_start, block_end = ref_data.block_start, ref_data.block_end
+    for i in gtf.rows('CDS'):
+        k = row(gtf.transcript_id[i])
+        if k is None or offsets[k] == offsets[k + 1]:
+            continue
+        if ref_data.strand(k) == '-':
+            is_first = gtf.end[i] == max(block_end[offsets[k]:offsets[k + 1]])
+        else:
+            is_first = gtf.start[i] == block_start[offsets[k]]
+        frame = gtf.frame(i)
+        if is_first and frame in ('1', '2'):
+            phases[k] = int(frame)
+    return phases
 
 def parse_asm_gtf(gtf_file):
-    """解析组装GTF"""
-    transcripts = {}
-    with open(gtf_file, 'r') as f:
-        for line in f:
-            if line.startswith('#'):
-                continue
-            fields = line.strip().split('\t')
-            if len(fields) < 9:
-                continue
-            
-            feature = fields[2]
-            start, end = int(fields[3]), int(fields[4])
-            strand = fields[6]
-            
-            transcript_id = None
-            gene_id = None
-            for attr in fields[8].split(';'):
-                attr = attr.strip()
-                if attr.startswith('transcript_id'):
-                    m = re.search(r'"([^"]+)"', attr)
-                    if m:
-                        transcript_id = m.group(1)
-                elif attr.startswith('gene_id'):
-                    m = re.search(r'"([^"]+)"', attr)
-                    if m:
-                        gene_id = m.group(1)
-            
-            if transcript_id is None:
-                continue
-            
-            if feature == 'mRNA':
-                if transcript_id not in transcripts:
-                    transcripts[transcript_id] = {
-                        'chrom': fields[0],
-                        'source': fields[1],
-                        'strand': strand,
-                        'gene_id': gene_id,
-                        'exons': []
-                    }
-            
-            elif feature == 'exon' and transcript_id in transcripts:
-                transcripts[transcript_id]['exons'].append((start, end))
-    
-    # 计算每个转录本的start和end（基于exons）
-    for tr_id, tr in transcripts.items():
-        if tr['exons']:
-            tr['start'] = min(e[0] for e in tr['exons'])
-            tr['end'] = max(e[1] for e in tr['exons'])
-    
-    return transcripts
+    """解析组装GTF（TranscriptStore，子区间为exons）"""
+    return build_transcripts(load_gtf(gtf_file), 'mRNA', 'exon')
 
-def get_utr_from_cds(tr_start, tr_end, cds_list, strand):
-    """根据CDS位置计算UTR"""
-    if not cds_list:
-        return None, None
-    
-    cds_sorted = sorted(cds_list)
-    
-    if strand == '+':
-        first_cds = cds_sorted[0][0]
-        last_cds = cds_sorted[-1][1]
-        
-        utr5 = (tr_start, first_cds - 1) if first_cds > tr_start else None
-        utr3 = (last_cds + 1, tr_end) if last_cds < tr_end else None
-    else:
-        first_cds = cds_sorted[0][0]
-        last_cds = cds_sorted[-1][1]
-        
-        utr3 = (tr_start, first_cds - 1) if first_cds > tr_start else None
-        utr5 = (last_cds + 1, tr_end) if last_cds < tr_end else None
-    
-    return utr5, utr3
+def intersect_blocks(starts, ends, blocks):
+    """两个已排序区间列表的交集 [(start, end), ...]（双指针，线性时间）"""
+    result = []
+    i, j = 0, 0
+    n, m = len(starts), len(blocks)
+    while i < n and j < m:
+        s, e = starts[i], ends[i]
+        bs, be = blocks[j]
+        lo = s if s > bs else bs
+        hi = e if e < be else be
+        if lo <= hi:
+            result.append((lo, hi))
+        if e < be:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def split_cds_utr(starts, ends, cds_list, strand):
+    """
+    根据exons和参考CDS计算(CDS, 5'UTR, 3'UTR)片段列表，均按start排序
+    CDS为参考CDS与exons的交集；UTR为CDS范围两侧的exon片段
+    """
+    cds = intersect_blocks(starts, ends, cds_list)
+    if not cds:
+        return [], [], []
+    cds_lo, cds_hi = cds[0][0], cds[-1][1]
+    left, right = [], []
+    for s, e in zip(starts, ends):
+        if s < cds_lo:
+            left.append((s, e if e < cds_lo else cds_lo - 1))
+        if e > cds_hi:
+            right.append((s if s > cds_hi else cds_hi + 1, e))
+    if strand == '-':
+        return cds, right, left
+    return cds, left, right
+
+def cds_phases(cds, ref_cds, ref_phase, strand):
+    """
+    按转录方向计算裁剪后各CDS片段的frame
+    第一个片段的相位由其5'端在参考CDS中的位置和参考5'端相位推出，之后按已输出的CDS长度递推
+    """
+    if strand == '-':
+        cds = cds[::-1]
+    # 第一个片段5'端在参考CDS剪接坐标中的偏移（未被裁剪时为0）
+    offset = 0
+    if strand == '-' and cds[0][1] != ref_cds[-1][1]:
+        first = cds[0][1]
+        for s, e in reversed(ref_cds):
+            if first >= s:
+                offset += e - first
+                break
+            offset += e - s + 1
+    elif strand != '-' and cds[0][0] != ref_cds[0][0]:
+        first = cds[0][0]
+        for s, e in ref_cds:
+            if first <= e:
+                offset += first - s
+                break
+            offset += e - s + 1
+    phase = (ref_phase - offset) % 3
+    phases = []
+    for s, e in cds:
+        phases.append(phase)
+        phase = (phase - (e - s + 1)) % 3
+    return phases[::-1] if strand == '-' else phases
+
+def index_cds_by_gene(ref_data):
+    """gene_id -> 有CDS的参考转录本行号列表（按参考GTF中的顺序）"""
+    gene_cds = {}
+    offsets = ref_data.offsets
+    for k, gene_id in enumerate(ref_data.gene_id):
+        if offsets[k] != offsets[k + 1]:
+            gene_cds.setdefault(gene_id, []).append(k)
+    return gene_cds
 
 def write_final_gtf(ref_data, asm_data, output_file):
     """写入最终GTF"""
     utr5_count, utr3_count, cds_count = 0, 0, 0
+    gene_cds = index_cds_by_gene(ref_data)
     
+    ids, offsets = asm_data.ids, asm_data.offsets
+    block_start, block_end = asm_data.block_start, asm_data.block_end
+    ref_row, ref_offsets = ref_data.row, ref_data.offsets
+    ref_phase = getattr(ref_data, 'phase5', None) or [0] * len(ref_data)
     with open(output_file, 'w') as f:
-        for tr_id in sorted(asm_data.keys()):
-            tr = asm_data[tr_id]
-            gene_id = tr['gene_id']
-            strand = tr['strand']
-            tr_start = tr.get('tr_start', tr['start'])
-            tr_end = tr.get('tr_end', tr['end'])
-            
-            if not tr['exons']:
+        for k in sorted(range(len(ids)), key=ids.__getitem__):
+            lo, hi = offsets[k], offsets[k + 1]
+            if lo == hi:
                 continue
             
-            # mRNA - 使用exons边界
-            exons = sorted(tr['exons'])
-            tr_start = min(e[0] for e in exons)
-            tr_end = max(e[1] for e in exons)
+            # mRNA - 使用exons边界（exons已按start排序）
+            starts, ends = block_start[lo:hi], block_end[lo:hi]
+            tr_start = starts[0]
+            tr_end = max(ends)
+            tr_id = ids[k]
+            gene_id = asm_data.gene_id[k]
+            strand = asm_data.strand(k)
+            prefix = f"{asm_data.chrom(k)}\t{asm_data.source(k)}\t"
+            attr = f"transcript_id \"{tr_id}\"; gene_id \"{gene_id}\";"
             
-            f.write(f"{tr['chrom']}\t{tr['source']}\tmRNA\t{tr_start}\t{tr_end}\t.\t{strand}\t.\ttranscript_id \"{tr_id}\"; gene_id \"{gene_id}\";\n")
+            lines = [f"{prefix}mRNA\t{tr_start}\t{tr_end}\t.\t{strand}\t.\t{attr}\n"]
             
             # exons
-            for i, (start, end) in enumerate(exons, 1):
-                f.write(f"{tr['chrom']}\t{tr['source']}\texon\t{start}\t{end}\t.\t{strand}\t.\ttranscript_id \"{tr_id}\"; gene_id \"{gene_id}\"; exon_number \"{i}\";\n")
+            lines += [f"{prefix}exon\t{start}\t{end}\t.\t{strand}\t.\t{attr} exon_number \"{i}\";\n"
+                      for i, (start, end) in enumerate(zip(starts, ends), 1)]
             
             # CDS - 从参考获取
-            cds_list = []
-            if tr_id in ref_data and ref_data[tr_id]['cds']:
-                cds_list = ref_data[tr_id]['cds']
-            elif gene_id in ref_data:
-                for tid, rd in ref_data.items():
-                    if rd['gene_id'] == gene_id and rd['cds']:
-                        cds_list = rd['cds']
-                        break
+            ref_k = ref_row(tr_id)
+            if ref_k is None or ref_offsets[ref_k] == ref_offsets[ref_k + 1]:
+                # 同一基因的第一个有CDS的参考转录本
+                ref_k = gene_cds[gene_id][0] if gene_id in gene_cds else None
             
-            if cds_list:
-                cds_sorted = sorted(cds_list)
-                for i, (start, end) in enumerate(cds_sorted, 1):
-                    f.write(f"{tr['chrom']}\t{tr['source']}\tCDS\t{start}\t{end}\t.\t{strand}\t0\ttranscript_id \"{tr_id}\"; gene_id \"{gene_id}\"; exon_number \"{i}\";\n")
-                    cds_count += 1
-                
-                # UTR - 基于exons边界
-                utr5, utr3 = get_utr_from_cds(tr_start, tr_end, cds_list, strand)
-                
-                if utr5:
-                    s, e = utr5
-                    f.write(f"{tr['chrom']}\t{tr['source']}\tfive_prime_utr\t{s}\t{e}\t.\t{strand}\t.\ttranscript_id \"{tr_id}\"; gene_id \"{gene_id}\";\n")
-                    utr5_count += 1
-                
-                if utr3:
-                    s, e = utr3
-                    f.write(f"{tr['chrom']}\t{tr['source']}\tthree_prime_utr\t{s}\t{e}\t.\t{strand}\t.\ttranscript_id \"{tr_id}\"; gene_id \"{gene_id}\";\n")
-                    utr3_count += 1
+            # CDS裁剪到exons内，UTR为CDS两侧的exon片段
+            cds = []
+            if ref_k is not None:
+                ref_cds = ref_data.blocks(ref_k)
+                cds, utr5, utr3 = split_cds_utr(starts, ends, ref_cds, strand)
+            if cds:
+                phases = cds_phases(cds, ref_cds, ref_phase[ref_k], strand)
+                lines += [f"{prefix}CDS\t{start}\t{end}\t.\t{strand}\t{phase}\t{attr} exon_number \"{i}\";\n"
+                          for i, ((start, end), phase) in enumerate(zip(cds, phases), 1)]
+                lines += [f"{prefix}five_prime_utr\t{s}\t{e}\t.\t{strand}\t.\t{attr}\n" for s, e in utr5]
+                lines += [f"{prefix}three_prime_utr\t{s}\t{e}\t.\t{strand}\t.\t{attr}\n" for s, e in utr3]
+                cds_count += len(cds)
+                utr5_count += len(utr5)
+                utr3_count += len(utr3)
+            f.write(''.join(lines))
     
     return utr5_count, utr3_count, cds_count
 
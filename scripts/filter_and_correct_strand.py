@@ -4,84 +4,73 @@ GTF过滤和链方向校正脚本
 功能：
 1. 剔除MSTRG开头的转录本
 2. 剔除长度<500bp的转录本
-3. 使用featureCounts分析链方向
+3. 使用featureCounts（或进程内pysam计数）分析链方向
 4. 翻转错误链方向的转录本
 """
+import hashlib
+import json
 import os
-import re
+import shutil
 import subprocess
 import pandas as pd
+from gtf_utils import file_sha1, load_gtf, open_text
+from run_report import RunReport
+from strand_counts import count_fragments, exon_features
+from transcript_store import build_transcripts
 
 class GTFFilterAndCorrector:
-    def __init__(self, input_gtf, bam_fwd, bam_rev, output_gtf, ratio_threshold=10):
+    def __init__(self, input_gtf, bam_fwd, bam_rev, output_gtf, ratio_threshold=10,
+                 count_engine='featurecounts', threads=8, featurecounts=None, cache_dir=None,
+                 report_file=None, profile_dir=None):
         self.input_gtf = input_gtf
         self.bam_fwd = bam_fwd
         self.bam_rev = bam_rev
         self.output_gtf = output_gtf
         self.ratio_threshold = ratio_threshold
-        self.featurecounts = '/home/czh/miniconda3/bin/featureCounts'
+        # count_engine: 'featurecounts' 调用外部程序; 'native' 用pysam在进程内计数
+        self.count_engine = count_engine
+        self.threads = threads
+        self.featurecounts = (featurecounts or shutil.which('featureCounts')
+                              or '/home/czh/miniconda3/bin/featureCounts')
+        # 计数缓存目录，设为False关闭缓存
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_gtf)), '.strand_count_cache')
+        self.cache_dir = cache_dir
+        # 各步骤耗时/内存报告(JSON)，profile_dir非空时每步另存cProfile结果
+        self.report_file = report_file
+        self.report = RunReport('filter_and_correct_strand', profile_dir)
+        self._gtf_tables = {}
         
+    def load_gtf(self, gtf_file):
+        """读入GTF，同一文件只解析一次"""
+        if gtf_file not in self._gtf_tables:
+            self._gtf_tables[gtf_file] = load_gtf(gtf_file)
+        return self._gtf_tables[gtf_file]
+    
     def get_transcript_info(self, gtf_file):
-        """从GTF提取转录本信息"""
-        transcripts = {}
-        with open(gtf_file, 'r') as f:
-            for line in f:
-                if line.startswith('#'):
-                    continue
-                fields = line.strip().split('\t')
-                if len(fields) < 9:
-                    continue
-                
-                if fields[2] != 'mRNA':
-                    continue
-                
-                chrom = fields[0]
-                start = int(fields[3])
-                end = int(fields[4])
-                strand = fields[6]
-                attributes = fields[8]
-                
-                tid = None
-                gid = None
-                for attr in attributes.split(';'):
-                    attr = attr.strip()
-                    if attr.startswith('transcript_id'):
-                        tid = attr.split('"')[1]
-                    elif attr.startswith('gene_id'):
-                        gid = attr.split('"')[1]
-                
-                if tid:
-                    length = end - start + 1
-                    transcripts[tid] = {
-                        'gene_id': gid,
-                        'chrom': chrom,
-                        'start': start,
-                        'end': end,
-                        'strand': strand,
-                        'length': length
-                    }
-        return transcripts
+        """从GTF提取转录本信息（TranscriptStore，重复的transcript_id以最后一条mRNA为准）"""
+        return build_transcripts(self.load_gtf(gtf_file), 'mRNA', keep='last')
     
     def filter_mstrg_and_short(self, transcripts):
         """剔除MSTRG开头和长度<500bp的转录本"""
-        keep_transcripts = {}
+        keep_transcripts = set()
         remove_mstrg = 0
         remove_short = 0
         
-        for tid, info in transcripts.items():
+        for k, tid in enumerate(transcripts.ids):
             if tid.startswith('MSTRG'):
                 remove_mstrg += 1
                 continue
-            if info['length'] < 500:
+            if transcripts.length(k) < 500:
                 remove_short += 1
                 continue
-            keep_transcripts[tid] = info
+            keep_transcripts.add(tid)
         
         print(f"MSTRG转录本: 删除 {remove_mstrg}")
         print(f"短转录本(<500bp): 删除 {remove_short}")
         print(f"保留转录本: {len(keep_transcripts)}")
         
-        return set(keep_transcripts.keys())
+        return keep_transcripts
     
     def run_featurecounts(self, keep_transcripts):
         """运行featureCounts"""
@@ -92,22 +81,87 @@ class GTFFilterAndCorrector:
         rev_count = os.path.join(work_dir, f'{prefix}_rev.txt')
         
         cmd_fwd = [self.featurecounts, '-s', '0', '-p', '-a', self.input_gtf,
-                   '-o', fwd_count, self.bam_fwd, '-T', '8']
+                   '-o', fwd_count, self.bam_fwd, '-T', str(self.threads)]
         cmd_rev = [self.featurecounts, '-s', '0', '-p', '-a', self.input_gtf,
-                   '-o', rev_count, self.bam_rev, '-T', '8']
+                   '-o', rev_count, self.bam_rev, '-T', str(self.threads)]
         
         print("运行featureCounts (fwd)...")
-        subprocess.run(cmd_fwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.report.run_subprocess(cmd_fwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         
         print("运行featureCounts (rev)...")
-        subprocess.run(cmd_rev, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.report.run_subprocess(cmd_rev, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         
         return fwd_count, rev_count
     
+    def count_native(self):
+        """
+        用pysam并行统计fwd/rev BAM的基因片段数，返回featureCounts格式的DataFrame
+        与featureCounts一样对GTF中全部基因计数（被剔除的基因也参与歧义判定），过滤在写出时进行
+        """
+        exons, gene_strands = exon_features(self.load_gtf(self.input_gtf))
+        
+        print(f"进程内计数 (fwd + rev, {self.threads} 进程)...")
+        fwd_counts, rev_counts = count_fragments([self.bam_fwd, self.bam_rev], exons, self.threads)
+        
+        gene_ids = list(gene_strands)
+        strands = [gene_strands[g] for g in gene_ids]
+        fwd = pd.DataFrame({'Geneid': gene_ids, 'Strand': strands,
+                            self.bam_fwd: [fwd_counts[g] for g in gene_ids]})
+        rev = pd.DataFrame({'Geneid': gene_ids, 'Strand': strands,
+                            self.bam_rev: [rev_counts[g] for g in gene_ids]})
+        return fwd, rev
+    
+    def count_cache_key(self):
+        """计数缓存键：BAM身份(路径/大小/mtime)、GTF内容哈希和计数参数"""
+        def bam_identity(path):
+            st = os.stat(path)
+            return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+        
+        key = {
+            'bam_fwd': bam_identity(self.bam_fwd),
+            'bam_rev': bam_identity(self.bam_rev),
+            'gtf_sha1': file_sha1(self.input_gtf),
+            'count_params': ['-s', '0', '-p'],
+            'count_engine': self.count_engine,
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    
+    def count_reads(self, keep_transcripts):
+        """按count_engine统计fwd/rev计数；BAM、GTF和计数参数都未变时直接读取缓存"""
+        if not self.cache_dir:
+            if self.count_engine == 'native':
+                return self.count_native()
+            return self.run_featurecounts(keep_transcripts)
+        
+        key = self.count_cache_key()
+        cached_fwd = os.path.join(self.cache_dir, f'{key}_fwd.txt')
+        cached_rev = os.path.join(self.cache_dir, f'{key}_rev.txt')
+        if os.path.exists(cached_fwd) and os.path.exists(cached_rev):
+            print(f"使用缓存计数: {key}")
+            return cached_fwd, cached_rev
+        
+        if self.count_engine == 'native':
+            fwd, rev = self.count_native()
+        else:
+            fwd, rev = self.run_featurecounts(keep_transcripts)
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for counts, cached in ((fwd, cached_fwd), (rev, cached_rev)):
+            tmp = cached + '.tmp'
+            if isinstance(counts, pd.DataFrame):
+                counts.to_csv(tmp, sep='\t', index=False)
+            else:
+                shutil.copyfile(counts, tmp)
+            os.replace(tmp, cached)
+        print(f"计数已缓存: {key}")
+        return fwd, rev
+    
     def analyze_strand(self, fwd_count, rev_count):
-        """分析链方向，确定需要翻转的转录本"""
-        fwd = pd.read_csv(fwd_count, sep='\t', comment='#')
-        rev = pd.read_csv(rev_count, sep='\t', comment='#')
+        """分析链方向，确定需要翻转的转录本
+        fwd_count/rev_count: featureCounts输出文件路径，或count_native返回的DataFrame
+        """
+        fwd = fwd_count if isinstance(fwd_count, pd.DataFrame) else pd.read_csv(fwd_count, sep='\t', comment='#')
+        rev = rev_count if isinstance(rev_count, pd.DataFrame) else pd.read_csv(rev_count, sep='\t', comment='#')
         
         fwd_col = fwd.columns[-1]
         rev_col = rev.columns[-1]
@@ -160,39 +214,36 @@ class GTFFilterAndCorrector:
         count_other = 0
         flip_count = 0
         
-        with open(self.input_gtf, 'r') as f, open(self.output_gtf, 'w') as out:
+        # 按原文件逐行输出：注释行和不足9列的行原样保留在原位置，
+        # 记录行与load_gtf读入的行一一对应，直接使用已解析的transcript_id
+        gtf = self.load_gtf(self.input_gtf)
+        transcript_ids = gtf.transcript_id
+        i = 0
+        with open_text(self.input_gtf) as f, open(self.output_gtf, 'w') as out:
             for line in f:
-                if line.startswith('#'):
+                if line[0] == '#':
                     out.write(line)
                     continue
-                
-                fields = line.strip().split('\t')
-                if len(fields) < 9:
+                if line.count('\t') < 8:
                     out.write(line)
                     continue
+                feature = gtf.feature(i)
+                tid = transcript_ids[i]
+                i += 1
                 
-                feature = fields[2]
-                strand = fields[6]
-                attributes = fields[8]
-                
-                tid = None
-                for attr in attributes.split(';'):
-                    attr = attr.strip()
-                    if attr.startswith('transcript_id'):
-                        tid = attr.split('"')[1]
-                        break
-                
-                # 检查是否在保留列表中
-                tid_base = tid.replace('.1', '') if tid else None
-                if tid_base not in keep_transcripts:
+                # 检查是否在保留列表中（与filter_mstrg_and_short一样按完整transcript_id）
+                if tid not in keep_transcripts:
                     continue
                 
                 # 检查是否需要翻转链方向
+                line = line.strip()
                 if tid in flip_dict:
+                    fields = line.split('\t')
                     fields[6] = flip_dict[tid]
+                    line = '\t'.join(fields)
                     flip_count += 1
                 
-                out.write('\t'.join(fields) + '\n')
+                out.write(line + '\n')
                 
                 # 统计
                 if feature == 'mRNA':
@@ -217,34 +268,51 @@ class GTFFilterAndCorrector:
         print(f"  其他: {count_other}")
         print(f"  翻转链方向: {flip_count}")
         print(f"\n输出文件: {self.output_gtf}")
+        return count_mrna + count_exon + count_cds + count_utr5 + count_utr3 + count_other
     
     def run(self):
         """运行完整流程"""
+        report = self.report
         print("=" * 60)
         print("Step 1: 提取转录本信息")
         print("=" * 60)
-        transcripts = self.get_transcript_info(self.input_gtf)
+        with report.stage('gtf_parse') as st:
+            transcripts = self.get_transcript_info(self.input_gtf)
+            st['records_in'] = len(self.load_gtf(self.input_gtf).start)
+            st['records_out'] = len(transcripts)
         print(f"总转录本: {len(transcripts)}")
         
         print("\n" + "=" * 60)
         print("Step 2: 过滤MSTRG和短转录本")
         print("=" * 60)
-        keep_transcripts = self.filter_mstrg_and_short(transcripts)
+        with report.stage('filter', records_in=len(transcripts)) as st:
+            keep_transcripts = self.filter_mstrg_and_short(transcripts)
+            st['records_out'] = len(keep_transcripts)
         
         print("\n" + "=" * 60)
-        print("Step 3: 运行featureCounts分析链方向")
+        print("Step 3: 统计fwd/rev计数分析链方向")
         print("=" * 60)
-        fwd_count, rev_count = self.run_featurecounts(keep_transcripts)
+        with report.stage('count', records_in=len(keep_transcripts)):
+            fwd_count, rev_count = self.count_reads(keep_transcripts)
         
         print("\n" + "=" * 60)
         print("Step 4: 分析链方向")
         print("=" * 60)
-        flip_dict = self.analyze_strand(fwd_count, rev_count)
+        with report.stage('strand_analysis') as st:
+            flip_dict = self.analyze_strand(fwd_count, rev_count)
+            st['records_out'] = len(flip_dict)
         
         print("\n" + "=" * 60)
         print("Step 5: 应用过滤和链方向校正")
         print("=" * 60)
-        self.apply_filter_and_correction(keep_transcripts, flip_dict)
+        with report.stage('filter_write', records_in=len(self.load_gtf(self.input_gtf).start)) as st:
+            st['records_out'] = self.apply_filter_and_correction(keep_transcripts, flip_dict)
+        if keep_transcripts and not st['records_out']:
+            raise RuntimeError(f"保留了{len(keep_transcripts)}个转录本，但{self.output_gtf}中没有写出任何记录")
+        
+        if self.report_file:
+            report.save(self.report_file)
+            print(f"\n运行报告: {self.report_file}")
         
         print("\n完成!")
 
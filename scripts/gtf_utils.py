@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+共享GTF读取模块
+一次读入整个GTF，按列存储（chrom/feature/strand等为分类编码，start/end为整数数组），
+gene_id/transcript_id在读入时提取并驻留，其余属性保留原始属性列，用attr_value按需取值
+所有输入都经open_text打开，透明支持.gz/.bgz压缩文件
+"""
+import gc
+import hashlib
+import io
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def attr_value(attributes, key):
+    """从属性列中取出 key "value" 的值，不存在时返回None"""
+    needle = key + ' "'
+    pos = attributes.find(needle)
+    # 跳过 ref_gene_id 之类以key结尾的属性名
+    while pos > 0 and attributes[pos - 1] not in ' ;':
+        pos = attributes.find(needle, pos + 1)
+    if pos < 0:
+        return None
+    begin = pos + len(needle)
+    end = attributes.find('"', begin)
+    if end < 0:
+        return None
+    return attributes[begin:end]
+
+
+def file_sha1(path):
+    """文件内容的SHA-1（用于缓存键）"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _inflate_bgzf_block(block):
+    """解压一个BGZF块（不含头部的deflate数据 + CRC32 + ISIZE）"""
+    data = zlib.decompress(block[:-8], -15)
+    crc, isize = struct.unpack('<II', block[-8:])
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError("BGZF块校验失败")
+    return data
+
+
+def _read_bgzf_block(f):
+    """读取下一个BGZF块的压缩数据，文件结束时返回None"""
+    header = f.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+        raise ValueError("不是有效的BGZF块")
+    (xlen,) = struct.unpack('<H', header[10:12])
+    extra = f.read(xlen)
+    pos = 0
+    bsize = None
+    while pos + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if extra[pos:pos + 2] == b'BC' and slen == 2:
+            (bsize,) = struct.unpack('<H', extra[pos + 4:pos + 6])
+        pos += 4 + slen
+    if bsize is None:
+        raise ValueError("BGZF块缺少BC字段")
+    rest = f.read(bsize + 1 - 12 - xlen)
+    if len(rest) != bsize + 1 - 12 - xlen:
+        raise EOFError("BGZF文件被截断")
+    return rest
+
+
+class _BackgroundDecompressor(io.RawIOBase):
+    """在后台线程中解压gzip/BGZF文件，解压结果经有界队列交给读取方"""
+
+    def __init__(self, path, bgzf, threads):
+        self._queue = queue.Queue(maxsize=32)
+        self._stop = threading.Event()
+        self._chunk = b''
+        self._pos = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._produce, args=(path, bgzf, threads), daemon=True)
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, path, bgzf, threads):
+        try:
+            if bgzf:
+                self._produce_bgzf(path, threads)
+            else:
+                self._produce_gzip(path)
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def _produce_gzip(self, path):
+        with open(path, 'rb') as f:
+            d = zlib.decompressobj(31)
+            pending = False
+            for data in iter(lambda: f.read(1 << 20), b''):
+                while data:
+                    pending = True
+                    if not self._put(d.decompress(data)):
+                        return
+                    if d.eof:
+                        # 多成员gzip：从剩余数据开始下一个成员
+                        data = d.unused_data
+                        d = zlib.decompressobj(31)
+                        pending = False
+                    else:
+                        data = b''
+            if pending:
+                raise EOFError(f"gzip文件被截断: {path}")
+
+    def _produce_bgzf(self, path, threads):
+        # 按块并行解压（zlib解压时释放GIL），按原顺序输出
+        with open(path, 'rb') as f, ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = deque()
+            while True:
+                block = _read_bgzf_block(f)
+                if block is not None:
+                    futures.append(pool.submit(_inflate_bgzf_block, block))
+                while futures and (block is None or len(futures) >= threads * 4):
+                    if not self._put(futures.popleft().result()):
+                        return
+                if block is None:
+                    return
+
+    def readinto(self, b):
+        while self._pos >= len(self._chunk):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+                return 0
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            self._chunk, self._pos = memoryview(item), 0
+        n = min(len(b), len(self._chunk) - self._pos)
+        b[:n] = self._chunk[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def open_text(path, threads=None):
+    """
+    打开文本输入文件；gzip(.gz)和BGZF(.bgz)压缩文件按文件头识别，
+    在后台线程解压（BGZF按块多线程并行），解析与解压重叠且不产生临时文件
+    """
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    if head[:2] != b'\x1f\x8b':
+        return open(path, 'r')
+    bgzf = bool(head[3] & 4) and head[12:14] == b'BC'
+    if threads is None:
+        threads = min(4, os.cpu_count() or 1)
+    raw = _BackgroundDecompressor(path, bgzf, threads)
+    return io.TextIOWrapper(io.BufferedReader(raw, buffer_size=1 << 20))
+
+
+class _Categories:
+    """字符串到整数编码的映射"""
+
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+
+    def code(self, name):
+        c = self.codes.get(name)
+        if c is None:
+            c = len(self.names)
+            self.codes[name] = c
+            self.names.append(name)
+        return c
+
+
+class GTFTable:
+    """列式存储的GTF记录"""
+
+    def __init__(self):
+        self.comments = []
+        self._chroms = _Categories()
+        self._sources = _Categories()
+        self._features = _Categories()
+        self._strands = _Categories()
+        self._scores = _Categories()
+        self._frames = _Categories()
+        self.chrom_codes = array('H')
+        self.source_codes = array('H')
+        self.feature_codes = array('H')
+        self.strand_codes = array('B')
+        self.score_codes = array('H')
+        self.frame_codes = array('B')
+        self.start = array('l')
+        self.end = array('l')
+        self.gene_id = []
+        self.transcript_id = []
+        self._raw_attributes = []
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def chroms(self):
+        return self._chroms.names
+
+    @property
+    def features(self):
+        return self._features.names
+
+    @property
+    def strands(self):
+        return self._strands.names
+
+    def chrom(self, i):
+        return self._chroms.names[self.chrom_codes[i]]
+
+    def source(self, i):
+        return self._sources.names[self.source_codes[i]]
+
+    def feature(self, i):
+        return self._features.names[self.feature_codes[i]]
+
+    def strand(self, i):
+        return self._strands.names[self.strand_codes[i]]
+
+    def score(self, i):
+        return self._scores.names[self.score_codes[i]]
+
+    def frame(self, i):
+        return self._frames.names[self.frame_codes[i]]
+
+    def raw_attributes(self, i):
+        return self._raw_attributes[i]
+
+    def rows(self, *features):
+        """返回指定feature的行号；不指定时返回全部行号"""
+        if not features:
+            return range(len(self))
+        wanted = {self._features.codes[f] for f in features if f in self._features.codes}
+        return [i for i, c in enumerate(self.feature_codes) if c in wanted]
+
+
+def _gene_transcript_ids(attributes):
+    """一次扫描属性列，返回(gene_id, transcript_id)，不存在的为None（与attr_value的匹配规则一致）"""
+    gene_id = transcript_id = None
+    parts = attributes.split('"')
+    for k in range(0, len(parts) - 1, 2):
+        key = parts[k]
+        if not key.endswith(' '):
+            continue
+        key = key[:-1]
+        # 属性名前必须是行首、空格或分号（跳过ref_gene_id之类）
+        if key.endswith('transcript_id') and key[-14:-13] in ('', ' ', ';'):
+            if transcript_id is None:
+                transcript_id = parts[k + 1]
+        elif key.endswith('gene_id') and key[-8:-7] in ('', ' ', ';'):
+            if gene_id is None:
+                gene_id = parts[k + 1]
+    return gene_id, transcript_id
+
+
+def load_gtf(gtf_file):
+    """读入GTF文件，返回GTFTable"""
+    table = GTFTable()
+    # chrom/source/feature/strand/score/frame六列的组合作为一个分类，读完后再拆成各列编码
+    combos = {}
+    combo_codes = array('l')
+    # 逐行调用的append预先绑定
+    add_combo, add_start, add_end = combo_codes.append, table.start.append, table.end.append
+    add_gene_id, add_transcript_id = table.gene_id.append, table.transcript_id.append
+    add_attributes = table._raw_attributes.append
+    comments = table.comments
+    intern = sys.intern
+    
+    # 构建大量小对象时暂停循环垃圾回收
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open_text(gtf_file) as f:
+            for line in f:
+                if line[0] == '#':
+                    comments.append(line)
+                    continue
+                fields = line.split('\t')
+                if len(fields) < 9:
+                    continue
+                key = (fields[0], fields[1], fields[2], fields[6], fields[5], fields[7])
+                code = combos.get(key)
+                if code is None:
+                    code = combos[key] = len(combos)
+                add_combo(code)
+                add_start(int(fields[3]))
+                add_end(int(fields[4]))
+                attributes = fields[8].rstrip('\r\n')
+                add_attributes(attributes)
+                # 属性列只扫描一次；常见的两种写法直接取值
+                parts = attributes.split('"', 4)
+                if len(parts) == 5 and parts[0] == 'transcript_id ' and parts[2] == '; gene_id ':
+                    gid, tid = parts[3], parts[1]
+                elif len(parts) == 5 and parts[0] == 'gene_id ' and parts[2] == '; transcript_id ':
+                    gid, tid = parts[1], parts[3]
+                elif len(parts) == 3 and parts[0] == 'gene_id ':
+                    gid, tid = parts[1], None
+                else:
+                    gid, tid = _gene_transcript_ids(attributes)
+                add_gene_id(intern(gid) if gid is not None else None)
+                add_transcript_id(intern(tid) if tid is not None else None)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    
+    categories = (table._chroms, table._sources, table._features,
+                  table._strands, table._scores, table._frames)
+    code_arrays = (table.chrom_codes, table.source_codes, table.feature_codes,
+                   table.strand_codes, table.score_codes, table.frame_codes)
+    for j, (category, codes) in enumerate(zip(categories, code_arrays)):
+        column = [category.code(combo[j]) for combo in combos]
+        codes.extend(map(column.__getitem__, combo_codes))
+    return table
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+In-memory interval overlap index (replaces `bedtools intersect`).
+
+Intervals are grouped per chromosome and sorted by start. A query only scans
+the intervals whose start lies in [query_start - max_length, query_end), so
+lookups cost O(log n + k) for the typical gene/feature length distribution.
+Overlap follows bedtools/BED semantics: start < other_end and other_start < end.
+"""
+from bisect import bisect_left
+
+
+class IntervalIndex:
+    def __init__(self, items):
+        """items: iterable of (chr, start, end, payload)"""
+        by_chr = {}
+        for order, (chr, start, end, payload) in enumerate(items):
+            by_chr.setdefault(chr, []).append((start, end, order, payload))
+
+        self._starts = {}
+        self._ends = {}
+        self._orders = {}
+        self._payloads = {}
+        self._max_len = {}
+        for chr, intervals in by_chr.items():
+            intervals.sort(key=lambda x: (x[0], x[2]))
+            self._starts[chr] = [iv[0] for iv in intervals]
+            self._ends[chr] = [iv[1] for iv in intervals]
+            self._orders[chr] = [iv[2] for iv in intervals]
+            self._payloads[chr] = [iv[3] for iv in intervals]
+            self._max_len[chr] = max(iv[1] - iv[0] for iv in intervals)
+
+    def __contains__(self, chr):
+        return chr in self._starts
+
+    def overlaps(self, chr, start, end):
+        """Payloads of all intervals overlapping [start, end), in input order"""
+        starts = self._starts.get(chr)
+        if starts is None:
+            return []
+        ends = self._ends[chr]
+        lo = bisect_left(starts, start - self._max_len[chr])
+        hi = bisect_left(starts, end)
+        hits = [i for i in range(lo, hi) if ends[i] > start]
+        if len(hits) > 1:
+            orders = self._orders[chr]
+            hits.sort(key=orders.__getitem__)
+        payloads = self._payloads[chr]
+        return [payloads[i] for i in hits]
+
+
+def sweep_stream(queries, starts, ends, orders):
+    """
+    Streaming sweep of one chromosome's queries against intervals sorted by
+    (start, order). queries: iterable of (chr, start, end, ...) in start order.
+    Yields (query, [interval indices]) with hits in input order, keeping only
+    the currently open intervals in memory.
+    """
+    n = len(starts)
+    j = 0
+    active = []
+    for query in queries:
+        start, end = query[1], query[2]
+        while j < n and starts[j] < end:
+            active.append(j)
+            j += 1
+        # queries come in start order, so finished intervals can be dropped
+        active = [k for k in active if ends[k] > start]
+        hits = [k for k in active if starts[k] < end]
+        if len(hits) > 1:
+            hits.sort(key=orders.__getitem__)
+        yield query, hits
+
+
+def sweep_sorted(queries, qis, starts, ends, orders):
+    """
+    Sweep the queries qis (indices into queries, any order) of one chromosome
+    against intervals sorted by (start, order). Yields (query_index,
+    [interval indices]) with hits in input order; queries are visited in
+    start order.
+    """
+    qis = sorted(qis, key=lambda qi: queries[qi][1])
+    swept = sweep_stream((queries[qi] for qi in qis), starts, ends, orders)
+    for qi, (_, hits) in zip(qis, swept):
+        yield qi, hits
+
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Metagene profile of exomePeak2 peaks over 5'UTR, CDS and 3'UTR.
+
+Every peak summit (the midpoint of the peak) is mapped onto the spliced
+coordinates of each same-strand coding isoform whose exons contain it, using
+the exon and CDS records that create_final_v4.py writes (in the
+strand-corrected GTF that annotate_peaks_cucumber.py indexes). The position is normalised
+within its region (0 = 5' end, 1 = 3' end, transcript orientation, so '-'
+strand isoforms are read right to left) and the peaks are binned into a
+density table.
+
+All of it is array work: exons are flattened into NumPy arrays with their
+offset from the transcript 5' end, CDS bounds are placed on the spliced
+coordinates with one searchsorted over (transcript, exon start) keys, and the
+summits of a chromosome/strand are matched against its exons with
+annotate_vectorized.overlap_pairs(). Only the GTF parse is per line.
+
+    python3 metagene_profile.py -o metagene_profile.tsv
+    python3 metagene_profile.py --bins 10,50,40 --isoforms longest --peaks-out summits.tsv
+
+A summit that falls in several isoforms counts 1/n for each of them
+(--isoforms all) or only for the longest one (--isoforms longest), so every
+mapped peak adds 1 to the profile. Summits in introns, in intergenic space or
+only in non-coding isoforms are left out and counted in the summary.
+"""
+import argparse
+
+from annotate_peaks_cucumber import GTF, PEAK_FWD, PEAK_REV
+from annotate_vectorized import np, overlap_pairs
+from gtf_utils import load_gtf
+from peak_input import read_peaks
+from transcript_store import build_transcripts
+
+OUTPUT = "exomePeak2_metagene_profile.tsv"
+REGIONS = ('five_prime_utr', 'CDS', 'three_prime_utr')
+
+# bins spread over the three regions in proportion to their median lengths
+# when --bins is auto
+TOTAL_BINS = 100
+
+# positions are packed with the transcript row into one int64 sort key; the
+# position is added, not or-ed, so starts below 1 still sort correctly
+_POS_BITS = 34
+
+
+class ExonModel:
+    """
+    Exons of all coding isoforms as flat arrays, plus per-isoform spliced
+    length and the spliced 5'UTR/CDS boundaries. Exon arrays are grouped per
+    (chrom, strand) and sorted by start within a group.
+    """
+
+    def __init__(self, stores):
+        ids, genes, chroms, strands = [], [], [], []
+        tx_len, cds5, cds3 = [], [], []
+        ex_start, ex_end, ex_offset, ex_tx = [], [], [], []
+        self.noncoding = self.inconsistent = 0
+        base = 0
+        for exons, cds in stores:
+            n = len(exons)
+            owner, start, end, offset, length = _spliced_exons(exons)
+            c5, c3, coding = _cds_bounds(exons, cds, owner, start, end, offset)
+            has_cds = np.diff(_np(cds.offsets)) > 0
+            self.noncoding += int((~has_cds).sum())
+            self.inconsistent += int((has_cds & ~coding).sum())
+
+            # keep the coding isoforms only, renumbered after the previous stores
+            keep = np.flatnonzero(coding)
+            row = np.full(n, -1, np.int64)
+            row[keep] = base + np.arange(len(keep))
+            exon_keep = coding[owner]
+            ex_tx.append(row[owner[exon_keep]])
+            ex_start.append(start[exon_keep])
+            ex_end.append(end[exon_keep])
+            ex_offset.append(offset[exon_keep])
+            ids += [exons.ids[k] for k in keep.tolist()]
+            genes += [exons.gene_id[k] for k in keep.tolist()]
+            chroms += [exons.chrom(k) for k in keep.tolist()]
+            strands += [exons.strand(k) for k in keep.tolist()]
+            tx_len.append(length[keep])
+            cds5.append(c5[keep])
+            cds3.append(c3[keep])
+            base += len(keep)
+
+        self.ids, self.genes = ids, genes
+        self.length = np.concatenate(tx_len) if tx_len else np.zeros(0, np.int64)
+        self.cds5 = np.concatenate(cds5) if cds5 else np.zeros(0, np.int64)
+        self.cds3 = np.concatenate(cds3) if cds3 else np.zeros(0, np.int64)
+        ex_tx = np.concatenate(ex_tx) if ex_tx else np.zeros(0, np.int64)
+        ex_start = np.concatenate(ex_start) if ex_start else np.zeros(0, np.int64)
+        ex_end = np.concatenate(ex_end) if ex_end else np.zeros(0, np.int64)
+        ex_offset = np.concatenate(ex_offset) if ex_offset else np.zeros(0, np.int64)
+
+        # (chrom, strand) -> exon arrays sorted by start
+        self.groups = {}
+        group_of = {}
+        tx_group = np.fromiter((group_of.setdefault((c, s), len(group_of)) for c, s in zip(chroms, strands)),
+                               np.int64, len(chroms))
+        ex_group = tx_group[ex_tx]
+        order = np.lexsort((ex_start, ex_group))
+        bounds = np.searchsorted(ex_group[order], np.arange(len(group_of) + 1))
+        for key, g in group_of.items():
+            sel = order[bounds[g]:bounds[g + 1]]
+            self.groups[key] = (ex_start[sel], ex_end[sel], ex_offset[sel], ex_tx[sel])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def region_lengths(self):
+        """(5'UTR, CDS, 3'UTR) spliced lengths per isoform"""
+        return self.cds5, self.cds3 - self.cds5 + 1, self.length - self.cds3 - 1
+
+
+def _np(values):
+    """int64 view of an array('l') column"""
+    return np.frombuffer(values, np.int64) if len(values) else np.zeros(0, np.int64)
+
+
+def _spliced_exons(store):
+    """
+    Per exon: owning row, start, end and the number of exonic bases between
+    the transcript 5' end and the exon's 5' end; per row: spliced length
+    """
+    offsets = _np(store.offsets)
+    counts = np.diff(offsets)
+    owner = np.repeat(np.arange(len(store)), counts)
+    start, end = _np(store.block_start), _np(store.block_end)
+    exon_len = end - start + 1
+    cum = np.cumsum(exon_len)
+    # exonic bases left of each exon within its own transcript
+    left = cum - exon_len - np.r_[0, cum][offsets[:-1]][owner]
+    length = np.zeros(len(store), np.int64)
+    np.add.at(length, owner, exon_len)
+    minus = np.fromiter((store.strand(k) == '-' for k in range(len(store))), bool, len(store))
+    offset = np.where(minus[owner], length[owner] - left - exon_len, left)
+    return owner, start, end, offset, length
+
+
+def _to_spliced(owner, start, end, offset, minus, rows, positions):
+    """
+    Spliced coordinate (0-based from the 5' end) of a genomic position in
+    the given rows; -1 where the position is not in an exon of that row
+    """
+    if not len(owner):
+        return np.full(len(rows), -1, np.int64)
+    exon_key = (owner << _POS_BITS) + start
+    idx = np.maximum(np.searchsorted(exon_key, (rows << _POS_BITS) + positions, side='right') - 1, 0)
+    inside = (owner[idx] == rows) & (start[idx] <= positions) & (end[idx] >= positions)
+    spliced = offset[idx] + np.where(minus, end[idx] - positions, positions - start[idx])
+    return np.where(inside, spliced, -1)
+
+
+def _cds_bounds(exons, cds, owner, start, end, offset):
+    """
+    Spliced positions of the first and last CDS base of every row, and
+    whether both lie on the row's exons (False for non-coding rows and for
+    CDS inherited from an isoform with a different exon chain)
+    """
+    n = len(exons)
+    if len(cds) != n:
+        raise ValueError("exon and CDS stores must come from the same GTF")
+    cds_offsets = _np(cds.offsets)
+    has_cds = np.diff(cds_offsets) > 0
+    rows = np.flatnonzero(has_cds)
+    lo = _np(cds.block_start)[cds_offsets[rows]]
+    hi = np.maximum.reduceat(_np(cds.block_end), cds_offsets[rows]) if len(rows) else np.zeros(0, np.int64)
+    minus = np.fromiter((exons.strand(k) == '-' for k in rows.tolist()), bool, len(rows))
+    t_lo = _to_spliced(owner, start, end, offset, minus, rows, lo)
+    t_hi = _to_spliced(owner, start, end, offset, minus, rows, hi)
+    c5, c3 = np.where(minus, t_hi, t_lo), np.where(minus, t_lo, t_hi)
+    cds5, cds3 = np.full(n, -1, np.int64), np.full(n, -1, np.int64)
+    cds5[rows], cds3[rows] = c5, c3
+    coding = np.zeros(n, bool)
+    coding[rows] = (c5 >= 0) & (c3 >= c5)
+    return cds5, cds3, coding
+
+
+def load_model(gtf_files):
+    """ExonModel of the coding isoforms in gtf_files (any mix of strands)"""
+    stores = []
+    for gtf_file in gtf_files:
+        gtf = load_gtf(gtf_file)
+        stores.append((build_transcripts(gtf, 'mRNA', 'exon'), build_transcripts(gtf, 'mRNA', 'CDS')))
+    return ExonModel(stores)
+
+
+def parse_bins(spec, model):
+    """Bins per region from 'auto' or 'n5,ncds,n3'"""
+    if spec != 'auto':
+        try:
+            bins = tuple(int(v) for v in spec.split(','))
+        except ValueError:
+            bins = ()
+        if len(bins) != 3 or min(bins) < 1:
+            raise ValueError(f"--bins needs three positive counts (5'UTR,CDS,3'UTR), got {spec!r}")
+        return bins
+    if not len(model):
+        return (1, 1, 1)
+    medians = [max(float(np.median(length)), 1.0) for length in model.region_lengths()]
+    return tuple(max(1, round(TOTAL_BINS * m / sum(medians))) for m in medians)
+
+
+def map_summits(model, peaks, isoforms='all'):
+    """
+    Map peak summits onto the model. peaks is a list of (chr, start, end,
+    strand, ...) tuples. Returns (peak index, isoform row, region 0/1/2,
+    relative position in [0, 1], weight) arrays, one entry per
+    (peak, isoform) pair kept.
+    """
+    by_group = {}
+    for i, peak in enumerate(peaks):
+        by_group.setdefault((peak[0], peak[3]), []).append(i)
+
+    out_q, out_tx, out_pos = [], [], []
+    for key, members in by_group.items():
+        group = model.groups.get(key)
+        if group is None:
+            continue
+        starts, ends, offsets, txs = group
+        members = np.asarray(members, np.int64)
+        summit = np.fromiter(((int(peaks[i][1]) + int(peaks[i][2])) // 2 for i in members.tolist()),
+                             np.int64, len(members))
+        # closed GTF coordinates: starts <= summit <= ends
+        pair_q, pair_k = overlap_pairs(starts, ends, summit - 1, summit + 1)
+        minus = key[1] == '-'
+        pos = offsets[pair_k] + ((ends[pair_k] - summit[pair_q]) if minus else (summit[pair_q] - starts[pair_k]))
+        out_q.append(members[pair_q])
+        out_tx.append(txs[pair_k])
+        out_pos.append(pos)
+
+    if not out_q:
+        empty = np.zeros(0, np.int64)
+        return empty, empty, empty, np.zeros(0), np.zeros(0)
+    q, tx, pos = np.concatenate(out_q), np.concatenate(out_tx), np.concatenate(out_pos)
+
+    # pairs grouped by peak; 'longest' keeps the longest isoform (lowest row on ties)
+    order = np.lexsort((tx, -model.length[tx], q))
+    q, tx, pos = q[order], tx[order], pos[order]
+    first = np.r_[True, q[1:] != q[:-1]]
+    if isoforms == 'longest':
+        q, tx, pos = q[first], tx[first], pos[first]
+        weight = np.ones(len(q))
+    else:
+        group_size = np.diff(np.r_[np.flatnonzero(first), len(q)])
+        weight = 1.0 / np.repeat(group_size, group_size)
+
+    cds5, cds3, length = model.cds5[tx], model.cds3[tx], model.length[tx]
+    region = (pos >= cds5).astype(np.int64) + (pos > cds3)
+    region_start = np.choose(region, [np.zeros_like(pos), cds5, cds3 + 1])
+    region_len = np.choose(region, [cds5, cds3 - cds5 + 1, length - cds3 - 1])
+    rel = (pos - region_start + 0.5) / region_len
+    return q, tx, region, rel, weight
+
+
+def profile(region, rel, weight, bins):
+    """Weighted peak count per bin, bins of the three regions laid end to end"""
+    bins = np.asarray(bins, np.int64)
+    first_bin = np.r_[0, np.cumsum(bins)[:-1]]
+    nb = bins[region]
+    index = first_bin[region] + np.minimum((rel * nb).astype(np.int64), nb - 1)
+    return np.bincount(index, weights=weight, minlength=int(bins.sum()))
+
+
+def write_profile(counts, bins, output):
+    """
+    One row per bin. position is the bin centre on a 0-3 metagene axis
+    (5'UTR 0-1, CDS 1-2, 3'UTR 2-3); density is normalised so that it
+    integrates to 1 over that axis.
+    """
+    total = counts.sum()
+    with open(output, 'w') as f:
+        f.write('region\tbin\tposition\tpeaks\tdensity\n')
+        i = 0
+        for r, (name, nb) in enumerate(zip(REGIONS, bins)):
+            for b in range(nb):
+                position = r + (b + 0.5) / nb
+                density = counts[i] * nb / total if total else 0.0
+                f.write(f"{name}\t{b + 1}\t{position:.4f}\t{counts[i]:.4f}\t{density:.6f}\n")
+                i += 1
+
+
+def write_summits(model, peaks, q, tx, region, rel, weight, output):
+    with open(output, 'w') as f:
+        f.write('chr\tpeak_start\tpeak_end\tstrand\tsummit\ttranscript_id\tgeneid\tregion\trel_position\tweight\n')
+        for qi, k, r, p, w in zip(q.tolist(), tx.tolist(), region.tolist(), rel.tolist(), weight.tolist()):
+            chr, start, end, strand = peaks[qi][:4]
+            summit = (int(start) + int(end)) // 2
+            f.write(f"{chr}\t{start}\t{end}\t{strand}\t{summit}\t{model.ids[k]}\t{model.genes[k]}\t"
+                    f"{REGIONS[r]}\t{p:.4f}\t{w:.4f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Metagene profile of peak summits over 5\'UTR, CDS and 3\'UTR')
+    parser.add_argument('--peak-fwd', default=PEAK_FWD, help='forward-strand exomePeak2 peaks.csv')
+    parser.add_argument('--peak-rev', default=PEAK_REV, help='reverse-strand exomePeak2 peaks.csv')
+    parser.add_argument('--gtf', default=GTF, help='strand-corrected GTF with exon and CDS records')
+    parser.add_argument('-o', '--output', default=OUTPUT, help=f'binned density table (default: {OUTPUT})')
+    parser.add_argument('--bins', default='auto',
+                        help="bins for 5'UTR,CDS,3'UTR, e.g. 10,50,40; auto splits "
+                             f"{TOTAL_BINS} bins by the median region lengths (default: auto)")
+    parser.add_argument('--isoforms', choices=('all', 'longest'), default='all',
+                        help='a summit in several isoforms counts 1/n for each (all, default) '
+                             'or 1 for the longest one')
+    parser.add_argument('--peaks-out', metavar='FILE',
+                        help='also write every mapped (peak, isoform) pair with its region and position')
+    parser.add_argument('--max-fdr', type=float, metavar='FDR', help='only profile peaks with fdr <= FDR')
+    parser.add_argument('--min-log2fc', type=float, metavar='LOG2FC',
+                        help='only profile peaks with log2FoldChange >= LOG2FC')
+    args = parser.parse_args()
+    if np is None:
+        parser.error('metagene_profile.py needs NumPy: pip install numpy')
+
+    try:
+        bins = None if args.bins == 'auto' else parse_bins(args.bins, None)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("Loading transcript models...")
+    model = load_model([args.gtf])
+    print(f"  {len(model)} coding isoforms ({model.noncoding} non-coding, "
+          f"{model.inconsistent} with CDS outside their exons skipped)")
+    bins = bins or parse_bins('auto', model)
+
+    print("Loading peaks...")
+    peaks = (read_peaks(args.peak_fwd, '+', args.max_fdr, args.min_log2fc) +
+             read_peaks(args.peak_rev, '-', args.max_fdr, args.min_log2fc))
+
+    print("Mapping summits...")
+    q, tx, region, rel, weight = map_summits(model, peaks, args.isoforms)
+    mapped = len(np.unique(q))
+    print(f"  {mapped} of {len(peaks)} peaks mapped ({len(q)} peak-isoform pairs)")
+
+    counts = profile(region, rel, weight, bins)
+    write_profile(counts, bins, args.output)
+    print(f"Profile ({bins[0]}/{bins[1]}/{bins[2]} bins) saved to {args.output}")
+    if args.peaks_out:
+        write_summits(model, peaks, q, tx, region, rel, weight, args.peaks_out)
+        print(f"Summit positions saved to {args.peaks_out}")
+
+
+if __name__ == '__main__':
+    main()
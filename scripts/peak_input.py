@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Reader for exomePeak2 peaks.csv tables.
+
+Columns are found by header name (seqnames, start, end, log2FoldChange,
+pvalue, fdr), not by position, and split by a real CSV parser, so quoted
+fields with commas and column order changes between exomePeak2 versions are
+handled; the other columns are never materialized. Uncompressed files are
+read with the multithreaded pyarrow CSV reader when pyarrow is installed;
+gzip/BGZF files (detected like gtf_utils.open_text) and chunked reads use
+the pandas C parser.
+
+Coordinates are parsed to int64 columns. log2FC, pvalue and fdr are kept as
+the text in the file, so the TSV output repeats them exactly; the max_fdr and
+min_log2fc filters parse them to float64 arrays (NA never passes) and select
+rows on whole columns before any peak tuple is built.
+
+Peaks are (chr, start, end, strand, log2FC, pvalue, fdr) tuples.
+"""
+import csv
+
+import pandas as pd
+
+from gtf_utils import open_text
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv
+except ImportError:
+    pa = None
+
+# peaks.csv header name -> peak table column
+PEAK_FIELDS = {'seqnames': 'chr', 'start': 'start', 'end': 'end', 'log2FoldChange': 'log2FC',
+               'pvalue': 'pvalue', 'fdr': 'fdr'}
+PEAK_COLUMNS = tuple(PEAK_FIELDS.values())
+_INT_FIELDS = ('start', 'end')
+
+# rows per chunk when peaks are read lazily (iter_peaks)
+READ_CHUNK = 500000
+
+
+def check_header(csv_file):
+    """Raise ValueError if the header of csv_file lacks one of PEAK_FIELDS"""
+    with open_text(csv_file) as f:
+        names = next(csv.reader(f), [])
+    missing = [name for name in PEAK_FIELDS if name not in names]
+    if missing:
+        raise ValueError(f"{csv_file}: no {', '.join(missing)} column in the peaks.csv header")
+
+
+def _is_compressed(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def _read_arrow(csv_file):
+    types = {name: pa.int64() if name in _INT_FIELDS else pa.string() for name in PEAK_FIELDS}
+    options = pa.csv.ConvertOptions(column_types=types, include_columns=list(PEAK_FIELDS),
+                                    strings_can_be_null=False)
+    return pa.csv.read_csv(csv_file, convert_options=options).to_pandas()
+
+
+def _read_pandas(handle, chunksize=None):
+    dtypes = {name: 'int64' if name in _INT_FIELDS else str for name in PEAK_FIELDS}
+    return pd.read_csv(handle, usecols=list(PEAK_FIELDS), dtype=dtypes, keep_default_na=False,
+                       chunksize=chunksize)
+
+
+def filter_peaks(frame, max_fdr=None, min_log2fc=None):
+    """Rows with fdr <= max_fdr and log2FC >= min_log2fc (each filter only if given)"""
+    keep = None
+    if max_fdr is not None:
+        keep = pd.to_numeric(frame['fdr'], errors='coerce').to_numpy(float) <= max_fdr
+    if min_log2fc is not None:
+        passed = pd.to_numeric(frame['log2FC'], errors='coerce').to_numpy(float) >= min_log2fc
+        keep = passed if keep is None else keep & passed
+    return frame if keep is None else frame[keep]
+
+
+def _peak_table(frame, max_fdr, min_log2fc):
+    return filter_peaks(frame.rename(columns=PEAK_FIELDS)[list(PEAK_COLUMNS)], max_fdr, min_log2fc)
+
+
+def read_peak_table(csv_file, max_fdr=None, min_log2fc=None):
+    """peaks.csv as a DataFrame with PEAK_COLUMNS (start/end int64), filtered while loading"""
+    check_header(csv_file)
+    if pa is not None and not _is_compressed(csv_file):
+        return _peak_table(_read_arrow(csv_file), max_fdr, min_log2fc)
+    with open_text(csv_file) as f:
+        return _peak_table(_read_pandas(f), max_fdr, min_log2fc)
+
+
+def peak_tuples(frame, strand):
+    """Peak tuples of a peak table, in file order"""
+    chrs, starts, ends, log2fcs, pvals, fdrs = [frame[name].tolist() for name in PEAK_COLUMNS]
+    return list(zip(chrs, starts, ends, [strand] * len(chrs), log2fcs, pvals, fdrs))
+
+
+def read_peaks(csv_file, strand, max_fdr=None, min_log2fc=None):
+    """All peaks of csv_file that pass the filters, as a list of peak tuples"""
+    return peak_tuples(read_peak_table(csv_file, max_fdr, min_log2fc), strand)
+
+
+def iter_peaks(csv_file, strand, max_fdr=None, min_log2fc=None, chunksize=READ_CHUNK):
+    """Like read_peaks, but read lazily in chunks of chunksize rows (bounded memory)"""
+    check_header(csv_file)
+    with open_text(csv_file) as f:
+        for chunk in _read_pandas(f, chunksize):
+            yield from peak_tuples(_peak_table(chunk, max_fdr, min_log2fc), strand)
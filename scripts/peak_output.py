@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Output formats for annotated peaks.
+
+Rows are (chr, peak_start, peak_end, strand, geneid, feature, log2FC, pvalue,
+fdr) tuples in position order, as produced by
+annotate_peaks_cucumber.result_rows(), optionally followed by the
+NEAREST_COLUMNS of intergenic peaks. Every requested format is written in
+the same single pass over the rows:
+
+    tsv      tab-separated text, values exactly as read (the default)
+    parquet  typed columns: int64 coordinates, float64 log2FC/pvalue/fdr
+             (NA -> null); needs pyarrow
+    arrow    the same table as an Arrow IPC file, loadable with zero parsing
+             via a memory map; needs pyarrow
+    bgzip    the TSV compressed with BGZF plus a tabix index (.tbi) for fast
+             region queries; needs pysam
+"""
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+COLUMNS = ('chr', 'peak_start', 'peak_end', 'strand', 'geneid', 'feature', 'log2FC', 'pvalue', 'fdr')
+# appended with --nearest-gene; NA unless the peak is intergenic
+NEAREST_COLUMNS = ('nearest_gene', 'distance', 'direction')
+# long-format isoform table (--isoforms): one row per (peak, gene, isoform)
+ISOFORM_COLUMNS = ('chr', 'peak_start', 'peak_end', 'strand', 'geneid', 'transcript_id', 'feature',
+                   'log2FC', 'pvalue', 'fdr')
+FORMATS = {'tsv': '.tsv', 'parquet': '.parquet', 'arrow': '.arrow', 'bgzip': '.tsv.gz'}
+
+# rows buffered per Arrow record batch / Parquet row group
+BATCH_SIZE = 200000
+
+
+def check_format(fmt):
+    """Raise RuntimeError if the library needed for fmt is not installed"""
+    if fmt in ('parquet', 'arrow') and pa is None:
+        raise RuntimeError(f"{fmt} output needs pyarrow: pip install pyarrow")
+    if fmt == 'bgzip' and pysam is None:
+        raise RuntimeError("bgzip output needs pysam: conda install -c bioconda pysam")
+
+
+def output_path(output, fmt):
+    """Path for fmt next to the TSV output (peaks.tsv -> peaks.parquet, peaks.tsv.gz, ...)"""
+    if fmt == 'tsv':
+        return output
+    base = output[:-len('.tsv')] if output.endswith('.tsv') else output
+    return base + FORMATS[fmt]
+
+
+def format_row(row):
+    return '\t'.join(map(str, row)) + '\n'
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _int(value):
+    return None if value == 'NA' else int(value)
+
+
+def _str(value):
+    return None if value == 'NA' else value
+
+
+# Arrow type and value converter per column; unlisted columns are plain strings
+_TYPED = {'peak_start': ('int64', int), 'peak_end': ('int64', int), 'log2FC': ('float64', _float),
+          'pvalue': ('float64', _float), 'fdr': ('float64', _float), 'distance': ('int64', _int),
+          'nearest_gene': ('string', _str), 'direction': ('string', _str)}
+
+
+class TSVSink:
+    def __init__(self, path, columns=COLUMNS):
+        self.path = path
+        self._f = open(path, 'w')
+        self._f.write('\t'.join(columns) + '\n')
+
+    def write(self, row):
+        self._f.write(format_row(row))
+
+    def close(self):
+        self._f.close()
+
+
+class BGZipSink(TSVSink):
+    """TSV written to a temporary file, then BGZF-compressed and tabix-indexed on close"""
+
+    def __init__(self, path, columns=COLUMNS):
+        self.final_path = path
+        super().__init__(path + '.tmp', columns)
+
+    def close(self):
+        super().close()
+        pysam.tabix_compress(self.path, self.final_path, force=True)
+        os.remove(self.path)
+        # 1-based closed coordinates as in the TSV; the header line is skipped
+        pysam.tabix_index(self.final_path, force=True, seq_col=0, start_col=1, end_col=2,
+                          line_skip=1, zerobased=False)
+
+
+class ArrowSink:
+    """Typed columns written in record batches to Parquet or an Arrow IPC file"""
+
+    def __init__(self, path, fmt, columns=COLUMNS):
+        self.path = path
+        types = [_TYPED.get(name, ('string', None)) for name in columns]
+        self.schema = pa.schema([(name, pa.type_for_alias(t)) for name, (t, _) in zip(columns, types)])
+        self._convert = [convert for _, convert in types]
+        if fmt == 'parquet':
+            self._writer = pa.parquet.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+        self._rows = []
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        columns = [col if convert is None else [convert(v) for v in col]
+                   for col, convert in zip(zip(*self._rows), self._convert)]
+        self._writer.write_batch(pa.record_batch(
+            [pa.array(col, type=field.type) for col, field in zip(columns, self.schema)], schema=self.schema))
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_sink(output, fmt, columns=COLUMNS):
+    check_format(fmt)
+    path = output_path(output, fmt)
+    if fmt == 'tsv':
+        return TSVSink(path, columns)
+    if fmt == 'bgzip':
+        return BGZipSink(path, columns)
+    return ArrowSink(path, fmt, columns)
+
+
+def write_rows(rows, output, formats=('tsv',), columns=COLUMNS):
+    """Write rows to output in every format; returns the number of rows"""
+    sinks = [open_sink(output, fmt, columns) for fmt in formats]
+    count = 0
+    try:
+        for row in rows:
+            for sink in sinks:
+                sink.write(row)
+            count += 1
+    finally:
+        for sink in sinks:
+            sink.close()
+    return count
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+从gffcompare注释后的StringTie合并结果生成final_annotation_v2.gtf
+transcript记录改为mRNA；与参考转录本匹配的组装转录本改用参考的transcript_id/gene_id，
+每个参考转录本只分配给匹配最好的一条（按class_code优先级，同级取先出现者），
+其余转录本保留MSTRG编号（在filter_and_correct_strand中剔除）
+"""
+from gtf_utils import attr_value, load_gtf
+
+# 可映射到参考转录本的class_code，越靠前匹配越好
+# （=完全匹配，c被包含，k包含参考，m/n内含子保留，j共享剪接位点，o同链重叠）
+CLASS_RANK = {code: rank for rank, code in enumerate('=ckmnjo')}
+
+def reference_names(gtf):
+    """组装transcript_id -> (参考transcript_id, 参考gene_id)，只含被选中改名的转录本"""
+    best = {}
+    for i in gtf.rows('transcript'):
+        attributes = gtf.raw_attributes(i)
+        rank = CLASS_RANK.get(attr_value(attributes, 'class_code'))
+        ref_id = attr_value(attributes, 'cmp_ref')
+        ref_gene = attr_value(attributes, 'ref_gene_id')
+        if rank is None or not ref_id or not ref_gene:
+            continue
+        current = best.get(ref_id)
+        if current is None or rank < current[0]:
+            best[ref_id] = (rank, gtf.transcript_id[i], ref_gene)
+    return {tid: (ref_id, ref_gene) for ref_id, (_, tid, ref_gene) in best.items()}
+
+def rename_assembly(annotated_gtf, output_gtf):
+    gtf = load_gtf(annotated_gtf)
+    names = reference_names(gtf)
+    transcript_code = gtf._features.codes.get('transcript')
+
+    chroms, sources, strands = gtf.chroms, gtf._sources.names, gtf.strands
+    chrom_codes, source_codes, strand_codes = gtf.chrom_codes, gtf.source_codes, gtf.strand_codes
+    starts, ends = gtf.start, gtf.end
+    count_mrna = 0
+    count_exon = 0
+    with open(output_gtf, 'w') as f:
+        for i in gtf.rows('transcript', 'exon'):
+            tid = gtf.transcript_id[i]
+            if not tid:
+                continue
+            tid, gene_id = names.get(tid, (tid, gtf.gene_id[i]))
+            if gtf.feature_codes[i] == transcript_code:
+                feature = 'mRNA'
+                count_mrna += 1
+            else:
+                feature = 'exon'
+                count_exon += 1
+            f.write(f"{chroms[chrom_codes[i]]}\t{sources[source_codes[i]]}\t{feature}\t{starts[i]}\t{ends[i]}\t.\t"
+                    f"{strands[strand_codes[i]]}\t.\ttranscript_id \"{tid}\"; gene_id \"{gene_id}\";\n")
+
+    print(f"mRNA: {count_mrna}, exon: {count_exon}, 映射到参考: {len(names)}")
+    print(f"输出: {output_gtf}")
+    return count_mrna, len(names)
+
+if __name__ == '__main__':
+    rename_assembly('/data/czh/reference_genome/cucumber/gffcompare_out.annotated.gtf',
+                    '/data/czh/reference_genome/cucumber/final_annotation_v2.gtf')
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Incremental runner for the GTF workflow in docs/GTF_pipeline.md:
+
+    create_cds_ref -> stringtie_fwd / stringtie_rev -> stringtie_merge
+        -> gffcompare -> rename_assembly -> create_final -> filter_and_correct_strand
+
+Every stage declares its input files, output files and parameters. Before a
+stage runs, the runner hashes its parameters together with the content of its
+inputs; if the key matches the one recorded after the last successful run and
+the outputs are still there unmodified, the stage is skipped. Re-running
+after changing, say, --ratio-threshold only re-runs the strand correction.
+
+Stages whose dependencies are done run concurrently (the two StringTie
+assemblies), within a total --threads budget. A stage whose input file is
+missing fails with the stage name and path instead of running. State lives in `<outdir>/.pipeline/state.json`, command logs in
+`<outdir>/logs/`.
+
+Usage:
+    python3 scripts/run_pipeline.py --outdir /data/czh/reference_genome/cucumber --threads 16
+    python3 scripts/run_pipeline.py --dry-run
+    python3 scripts/run_pipeline.py --force stringtie_merge
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from gtf_utils import file_sha1
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join('.pipeline', 'state.json')
+
+
+class Stage:
+    """
+    One pipeline step. `action(threads)` produces `outputs` from `inputs`;
+    `params` holds everything besides the input files that affects the
+    outputs (thread counts deliberately excluded).
+    """
+    def __init__(self, name, inputs, outputs, params, action, threads=1):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params
+        self.action = action
+        self.threads = threads
+
+
+class PipelineState:
+    """
+    Stage keys and output signatures from previous runs. File content hashes
+    are memoised by (size, mtime), so unchanged BAMs are hashed only once.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.stages = data.get('stages', {})
+        self.hashes = data.get('hashes', {})
+
+    def signature(self, path):
+        st = os.stat(path)
+        real = os.path.realpath(path)
+        with self.lock:
+            memo = self.hashes.get(real)
+        if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            return memo[2]
+        sha1 = file_sha1(path)
+        with self.lock:
+            self.hashes[real] = [st.st_size, st.st_mtime_ns, sha1]
+        return sha1
+
+    def stage_key(self, stage):
+        for path in stage.inputs:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"missing input {path}")
+        key = {'stage': stage.name, 'params': stage.params,
+               'inputs': [[path, self.signature(path)] for path in stage.inputs]}
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def is_current(self, stage, key):
+        record = self.stages.get(stage.name)
+        if record is None or record['key'] != key:
+            return False
+        for path in stage.outputs:
+            if not os.path.exists(path) or record['outputs'].get(path) != self.signature(path):
+                return False
+        return True
+
+    def forget(self, stage):
+        with self.lock:
+            self.stages.pop(stage.name, None)
+        self.save()
+
+    def record(self, stage, key):
+        outputs = {path: self.signature(path) for path in stage.outputs}
+        with self.lock:
+            self.stages[stage.name] = {'key': key, 'outputs': outputs,
+                                       'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self.save()
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'stages': self.stages, 'hashes': self.hashes}, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+def local_modules(module):
+    """
+    Paths of scripts/<module>.py and of every sibling module it imports,
+    directly or indirectly (function-level imports included), sorted
+    """
+    paths = set()
+    pending = [module]
+    while pending:
+        path = os.path.join(SCRIPTS_DIR, pending.pop() + '.py')
+        if path in paths or not os.path.exists(path):
+            continue
+        paths.add(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module)
+    return sorted(paths)
+
+
+def command(argv, log_file):
+    """Stage action running an external program; argv(threads) builds the command line"""
+    def run(threads):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        with open(log_file, 'w') as log:
+            subprocess.run(argv(threads), check=True, stdout=log, stderr=subprocess.STDOUT)
+    return run
+
+
+def build_stages(args):
+    out = lambda name: os.path.join(args.outdir, name)
+    log = lambda name: os.path.join(args.outdir, 'logs', f'{name}.log')
+    half = max(1, args.threads // 2)
+
+    cds_ref = out('ChineseLong_v3_CDS_only.gtf')
+    assemblies = {'fwd': out('stringtie_fwd.gtf'), 'rev': out('stringtie_rev.gtf')}
+    merge_list = out('merge_list.txt')
+    merged = out('stringtie_merged.gtf')
+    gffcompare_prefix = out('gffcompare_out')
+    annotated = f'{gffcompare_prefix}.annotated.gtf'
+    renamed = out('final_annotation_v2.gtf')
+    final_gtf = out('ChineseLong_v3.final.gtf')
+    corrected_gtf = out('ChineseLong_v3.final.strand_corrected.gtf')
+
+    def create_cds(threads):
+        from create_cds_ref import create_cds_ref
+        create_cds_ref(args.ref_gtf, cds_ref)
+
+    stages = [Stage('create_cds_ref', [args.ref_gtf, *local_modules('create_cds_ref')],
+                    [cds_ref], {}, create_cds)]
+
+    for label, bam in (('fwd', args.bam_fwd), ('rev', args.bam_rev)):
+        assembly_params = ['-l', label, '-f', str(args.min_fpkm), '-g', str(args.max_gap)]
+        argv = (lambda threads, bam=bam, label=label, params=assembly_params:
+                [args.stringtie, '-G', cds_ref, '-o', assemblies[label], *params, '-p', str(threads), bam])
+        stages.append(Stage(f'stringtie_{label}', [cds_ref, bam], [assemblies[label]],
+                            {'argv': assembly_params}, command(argv, log(f'stringtie_{label}')), threads=half))
+
+    def merge(threads):
+        with open(merge_list, 'w') as f:
+            f.write(f"{assemblies['fwd']}\n{assemblies['rev']}\n")
+        command(lambda t: [args.stringtie, '--merge', '-G', cds_ref, '-o', merged, merge_list],
+                log('stringtie_merge'))(threads)
+
+    stages.append(Stage('stringtie_merge', [cds_ref, assemblies['fwd'], assemblies['rev']],
+                        [merge_list, merged], {}, merge))
+
+    stages.append(Stage('gffcompare', [args.ref_gtf, merged],
+                        [f'{gffcompare_prefix}.stats', annotated], {},
+                        command(lambda t: [args.gffcompare, '-r', args.ref_gtf, '-o', gffcompare_prefix, merged],
+                                log('gffcompare'))))
+
+    # StringTie writes transcript records with MSTRG gene ids; create_final needs
+    # mRNA records named after the reference genes they match
+    def rename(threads):
+        from rename_assembly import rename_assembly
+        rename_assembly(annotated, renamed)
+
+    stages.append(Stage('rename_assembly', [annotated, *local_modules('rename_assembly')],
+                        [renamed], {}, rename))
+
+    def create_final(threads):
+        from create_final_v4 import parse_asm_gtf, parse_ref_gtf, write_final_gtf
+        utr5, utr3, cds = write_final_gtf(parse_ref_gtf(args.ref_gtf), parse_asm_gtf(renamed), final_gtf)
+        print(f"[create_final] CDS: {cds}, 5'UTR: {utr5}, 3'UTR: {utr3}")
+
+    stages.append(Stage('create_final', [args.ref_gtf, renamed, *local_modules('create_final_v4')],
+                        [final_gtf], {}, create_final))
+
+    def filter_and_correct(threads):
+        from filter_and_correct_strand import GTFFilterAndCorrector
+        GTFFilterAndCorrector(final_gtf, args.bam_fwd, args.bam_rev, corrected_gtf,
+                              ratio_threshold=args.ratio_threshold, count_engine=args.count_engine,
+                              threads=threads).run()
+
+    stages.append(Stage('filter_and_correct_strand',
+                        [final_gtf, args.bam_fwd, args.bam_rev, *local_modules('filter_and_correct_strand')],
+                        [corrected_gtf],
+                        {'ratio_threshold': args.ratio_threshold, 'count_engine': args.count_engine},
+                        filter_and_correct, threads=args.threads))
+    return stages
+
+
+def dependencies(stages):
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    return {stage.name: {producers[path] for path in stage.inputs if path in producers}
+            for stage in stages}
+
+
+def run_pipeline(stages, state, threads, force=(), dry_run=False):
+    """
+    Run stages in dependency order, skipping those that are up to date.
+    Ready stages run concurrently while their thread requests fit in the budget.
+    Returns {stage: 'skipped' | 'ran' | 'would run'}.
+    """
+    deps = dependencies(stages)
+    status = {}
+    pending = list(stages)
+    running = {}
+    free = threads
+    failed = None
+
+    def execute(stage, key, n):
+        state.forget(stage)
+        start = time.perf_counter()
+        print(f"[{stage.name}] running ({n} threads)", flush=True)
+        stage.action(n)
+        state.record(stage, key)
+        print(f"[{stage.name}] done in {time.perf_counter() - start:.1f} s", flush=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as pool:
+        while pending or running:
+            for stage in list(pending):
+                if failed or not deps[stage.name].issubset(status):
+                    continue
+                if dry_run:
+                    stale = ('all' in force or stage.name in force
+                             or any(status[d] != 'skipped' for d in deps[stage.name])
+                             or not all(os.path.exists(p) for p in stage.inputs)
+                             or not state.is_current(stage, state.stage_key(stage)))
+                    status[stage.name] = 'would run' if stale else 'skipped'
+                    print(f"[{stage.name}] {status[stage.name]}")
+                    pending.remove(stage)
+                    continue
+                try:
+                    key = state.stage_key(stage)
+                except FileNotFoundError as e:
+                    print(f"[{stage.name}] {e}", file=sys.stderr, flush=True)
+                    failed = stage.name
+                    pending.remove(stage)
+                    continue
+                if 'all' not in force and stage.name not in force and state.is_current(stage, key):
+                    print(f"[{stage.name}] up to date, skipped", flush=True)
+                    status[stage.name] = 'skipped'
+                    pending.remove(stage)
+                    continue
+                n = min(stage.threads, threads)
+                if n > free and running:
+                    continue
+                free -= n
+                pending.remove(stage)
+                running[pool.submit(execute, stage, key, n)] = (stage, n)
+
+            if not running:
+                # everything left depends on a failed stage
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, n = running.pop(future)
+                free += n
+                try:
+                    future.result()
+                    status[stage.name] = 'ran'
+                except Exception as e:
+                    print(f"[{stage.name}] failed: {e}", file=sys.stderr, flush=True)
+                    failed = failed or stage.name
+
+    state.save()
+    if failed:
+        raise RuntimeError(f"stage {failed} failed; later stages were not run")
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the ChineseLong v3 GTF pipeline, skipping up-to-date stages')
+    parser.add_argument('--ref-gtf', default='/data/czh/reference_genome/cucumber/ChineseLong_v3.gtf')
+    parser.add_argument('--bam-fwd', default='/data2/czh/TEL/cucumber/MeRIP_Seq_1/ssbamfiles/merged_BAM/cs_9300_Input_fwd.bam')
+    parser.add_argument('--bam-rev', default='/data2/czh/TEL/cucumber/MeRIP_Seq_1/ssbamfiles/merged_BAM/cs_9300_Input_rev.bam')
+    parser.add_argument('-o', '--outdir', default='/data/czh/reference_genome/cucumber')
+    parser.add_argument('-t', '--threads', type=int, default=8,
+                        help='total thread budget shared by concurrently running stages (default: 8)')
+    parser.add_argument('--stringtie', default='stringtie')
+    parser.add_argument('--gffcompare', default='gffcompare')
+    parser.add_argument('--min-fpkm', type=float, default=0.01, help='stringtie -f (default: 0.01)')
+    parser.add_argument('--max-gap', type=int, default=50, help='stringtie -g (default: 50)')
+    parser.add_argument('--ratio-threshold', type=float, default=10)
+    parser.add_argument('--count-engine', choices=['featurecounts', 'native'], default='featurecounts')
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE',
+                        help="re-run STAGE even if it is up to date (repeatable; 'all' for every stage)")
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only report which stages would run')
+    args = parser.parse_args()
+
+    stages = build_stages(args)
+    unknown = set(args.force) - {stage.name for stage in stages} - {'all'}
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    state = PipelineState(os.path.join(args.outdir, STATE_FILE))
+    try:
+        run_pipeline(stages, state, args.threads, force=args.force, dry_run=args.dry_run)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Stage-level run instrumentation.
+
+    report = RunReport('filter_and_correct_strand', profile_dir='profiles')
+    with report.stage('gtf_parse') as st:
+        transcripts = ...
+        st['records_out'] = len(transcripts)
+    report.run_subprocess(['featureCounts', ...])   # timed into the current stage
+    report.save('run_report.json')
+
+Each stage records wall time, CPU time of this process and of reaped child
+processes, peak RSS, records in/out and the wall time spent in subprocesses.
+With profile_dir set, every stage is also profiled with cProfile and dumped
+to `<profile_dir>/<report>.<stage>.prof`.
+"""
+import cProfile
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+
+def _maxrss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak-RSS counter (Linux >= 4.0); False if unsupported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _maxrss_mb(resource.RUSAGE_SELF)
+
+
+class RunReport:
+    def __init__(self, name, profile_dir=None):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.started = time.time()
+        self.stages = []
+        self._current = None
+
+    @contextmanager
+    def stage(self, name, records_in=None):
+        """Time a block; yields the stage dict so callers can set records_out"""
+        record = {'stage': name, 'records_in': records_in, 'records_out': None,
+                  'subprocess_seconds': 0.0}
+        outer, self._current = self._current, record
+        peak_is_per_stage = _reset_peak_rss()
+        profiler = cProfile.Profile() if self.profile_dir else None
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+            record['cpu_seconds'] = round(time.process_time() - cpu, 4)
+            record['child_cpu_seconds'] = round(max(0.0, children_after.ru_utime + children_after.ru_stime
+                                                - children.ru_utime - children.ru_stime), 4)
+            record['subprocess_seconds'] = round(record['subprocess_seconds'], 4)
+            # without a per-stage reset this is the process-wide peak so far
+            record['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+            record['peak_rss_scope'] = 'stage' if peak_is_per_stage else 'process'
+            record['child_peak_rss_mb'] = round(_maxrss_mb(resource.RUSAGE_CHILDREN), 1)
+            if profiler:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                safe = re.sub(r'[^A-Za-z0-9_.+-]', '_', f'{self.name}.{name}')
+                record['profile'] = os.path.join(self.profile_dir, f'{safe}.prof')
+                profiler.dump_stats(record['profile'])
+            self._current = outer
+            self.stages.append(record)
+
+    def run_subprocess(self, cmd, **kwargs):
+        """subprocess.run(cmd, **kwargs), with its wall time added to the current stage"""
+        start = time.perf_counter()
+        try:
+            return subprocess.run(cmd, **kwargs)
+        finally:
+            if self._current is not None:
+                self._current['subprocess_seconds'] += time.perf_counter() - start
+
+    def extend(self, stages, prefix=''):
+        """Add stage records produced elsewhere (e.g. in a worker process)"""
+        for record in stages:
+            record = dict(record)
+            record['stage'] = prefix + record['stage']
+            self.stages.append(record)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'total_wall_seconds': round(time.time() - self.started, 4),
+            'python': platform.python_version(),
+            'host': platform.node(),
+            'argv': sys.argv,
+            'stages': self.stages,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+紧凑的转录本存储
+每个转录本一行：gene_id/transcript_id驻留字符串，chrom/source/strand为GTFTable的分类编码，
+start/end为整数数组；外显子或CDS等子区间拼接为扁平数组，按转录本用offsets索引，
+每个转录本内按(start, end)排序
+"""
+from array import array
+
+
+class TranscriptStore:
+    """按行号k访问的转录本表，ids[k]为transcript_id"""
+
+    def __init__(self, gtf):
+        self._chroms = gtf.chroms
+        self._sources = gtf._sources.names
+        self._strands = gtf.strands
+        self.ids = []
+        self._rows = {}
+        self.gene_id = []
+        self.chrom_codes = array('H')
+        self.source_codes = array('H')
+        self.strand_codes = array('B')
+        self.start = array('l')
+        self.end = array('l')
+        # 第k个转录本的子区间为 block_start/block_end[offsets[k]:offsets[k + 1]]
+        self.offsets = array('l', [0])
+        self.block_start = array('l')
+        self.block_end = array('l')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, transcript_id):
+        return transcript_id in self._rows
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def row(self, transcript_id):
+        """transcript_id对应的行号，不存在时返回None"""
+        return self._rows.get(transcript_id)
+
+    def chrom(self, k):
+        return self._chroms[self.chrom_codes[k]]
+
+    def source(self, k):
+        return self._sources[self.source_codes[k]]
+
+    def strand(self, k):
+        return self._strands[self.strand_codes[k]]
+
+    def length(self, k):
+        return self.end[k] - self.start[k] + 1
+
+    def blocks(self, k):
+        """第k个转录本的子区间 [(start, end), ...]，已排序"""
+        lo, hi = self.offsets[k], self.offsets[k + 1]
+        return list(zip(self.block_start[lo:hi], self.block_end[lo:hi]))
+
+
+def build_transcripts(gtf, parent_feature='mRNA', block_feature=None, keep='first'):
+    """
+    从GTFTable构建TranscriptStore
+    parent_feature行定义转录本（重复的transcript_id按keep保留first或last一行的坐标）；
+    block_feature行作为子区间，只收录出现在其转录本parent行之后的记录
+    """
+    store = TranscriptStore(gtf)
+    rows = store._rows
+    parent_code = gtf._features.codes.get(parent_feature)
+    features = (parent_feature, block_feature) if block_feature else (parent_feature,)
+    owners = array('l')
+    starts = array('l')
+    ends = array('l')
+
+    for i in gtf.rows(*features):
+        tid = gtf.transcript_id[i]
+        if not tid:
+            continue
+        k = rows.get(tid)
+        if gtf.feature_codes[i] == parent_code:
+            if k is None:
+                rows[tid] = len(store.ids)
+                store.ids.append(tid)
+                store.gene_id.append(gtf.gene_id[i])
+                store.chrom_codes.append(gtf.chrom_codes[i])
+                store.source_codes.append(gtf.source_codes[i])
+                store.strand_codes.append(gtf.strand_codes[i])
+                store.start.append(gtf.start[i])
+                store.end.append(gtf.end[i])
+            elif keep == 'last':
+                store.gene_id[k] = gtf.gene_id[i]
+                store.chrom_codes[k] = gtf.chrom_codes[i]
+                store.source_codes[k] = gtf.source_codes[i]
+                store.strand_codes[k] = gtf.strand_codes[i]
+                store.start[k] = gtf.start[i]
+                store.end[k] = gtf.end[i]
+        elif k is not None:
+            owners.append(k)
+            starts.append(gtf.start[i])
+            ends.append(gtf.end[i])
+
+    # 按转录本分桶（计数排序），再在每个桶内按(start, end)排序
+    n = len(store.ids)
+    counts = [0] * (n + 1)
+    for k in owners:
+        counts[k + 1] += 1
+    for k in range(n):
+        counts[k + 1] += counts[k]
+    store.offsets = array('l', counts)
+    fill = counts[:-1]
+    block_start = array('l', starts)
+    block_end = array('l', ends)
+    unsorted = set()
+    for k, start, end in zip(owners, starts, ends):
+        pos = fill[k]
+        block_start[pos] = start
+        block_end[pos] = end
+        if pos > counts[k] and (start, end) < (block_start[pos - 1], block_end[pos - 1]):
+            unsorted.add(k)
+        fill[k] = pos + 1
+    for k in unsorted:
+        lo, hi = counts[k], counts[k + 1]
+        ordered = sorted(zip(block_start[lo:hi], block_end[lo:hi]))
+        block_start[lo:hi] = array('l', (s for s, _ in ordered))
+        block_end[lo:hi] = array('l', (e for _, e in ordered))
+    store.block_start = block_start
+    store.block_end = block_end
+    return store